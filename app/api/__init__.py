@@ -9,7 +9,6 @@ from app.api.auth import Authentication
 from app.api.permissions import Permissions
 from app.api.record_space import RecordSpace
 from app.api.file import File
-from app.api.scan import ScanFiles, ScanStatus
 from app.api.test import Test
 
 api_bp = Blueprint("api", __name__)
@@ -23,8 +22,6 @@ api.add_resource(RecordSpace,
 api.add_resource(File,
                  "/file",
                  "/file/<string:destination_path>")
-api.add_resource(ScanFiles, "/scan-files/<string:user_name>/<string:record_name>")
-api.add_resource(ScanStatus, "/scan-status/<string:task_id>")
 api.add_resource(Permissions,
                  "/permissions/<string:user_name>/<string:record_name>/<string:permission_type>",
                  "/permissions/<string:user_name>/<string:record_name>"
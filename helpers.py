@@ -1,70 +1,73 @@
 """
 helpers methods
 """
+import re
+
+# Text of the message and permissions elements of a generic layer response
+MESSAGE_RE = re.compile(rb'<message>([^<]*)')
+PERMISSIONS_RE = re.compile(rb'<permissions>([^<]*)')
+
+
+# Nextcloud permission bitmask (0-31) to permission level
+PERMISSIONS_STRINGS = (("No permissions (No access to the file or folder)",)
+                       + ("Read",) * 3
+                       + ("Write",) * 4
+                       + ("Delete",) * 8
+                       + ("Share",) * 14
+                       + ("All",) * 2)
+
+# Permission level to the Nextcloud permission bitmask granting it
+PERMISSIONS_NUMBERS = {
+    "No permissions (No access to the file or folder)": 0,
+    "Read": 3,
+    "Write": 7,
+    "Delete": 15,
+    "Share": 29,
+    "All": 31,
+}
 
 
 def get_permissions_string(permission_number):
-    if permission_number == 0:
-        return "No permissions (No access to the file or folder)"
-    elif 1 <= permission_number <= 3:
-        return "Read"
-    elif 4 <= permission_number <= 7:
-        return "Write"
-    elif 8 <= permission_number <= 15:
-        return "Delete"
-    elif 16 <= permission_number <= 29:
-        return "Share"
-    elif permission_number == 30 or permission_number == 31:
-        return "All"
-    else:
-        return "Invalid permissions"
+    if 0 <= permission_number < len(PERMISSIONS_STRINGS):
+        return PERMISSIONS_STRINGS[permission_number]
+    return "Invalid permissions"
 
 
 def get_permissions_number(permission_string):
-    if permission_string == "No permissions (No access to the file or folder)":
-        return 0
-    elif permission_string == "Read":
-        return 3
-    elif permission_string == "Write":
-        return 7
-    elif permission_string == "Delete":
-        return 15
-    elif permission_string == "Share":
-        return 29
-    elif permission_string == "All":
-        return 31
-    else:
-        return "Invalid permissions"
+    return PERMISSIONS_NUMBERS.get(permission_string, "Invalid permissions")
+
+
+def response_bytes(response):
+    """
+    Return the body of a generic layer response, given as a list of strings or a response object
+    """
+    if isinstance(response, list):
+        return ''.join(response).encode()
+    return response.content
 
 
 def extract_failure_msgs(response):
-    failure_msgs = ''
+    data = response_bytes(response)
 
-    if isinstance(response, list):
-        elements = ''.join(response).split('<message>')[1:]
-    else:
-        elements = response.content.decode().split('<message>')[1:]
+    # Responses usually only report successes, which counting finds without scanning each message
+    if data.count(b'<message>') == data.count(b'<message>ok<') + data.count(b'<message>OK<'):
+        return ''
 
-    for element in elements:
-        element = element.split('<')[0].replace("\\", "")
-        if element.lower() != 'ok' and element not in failure_msgs:
-            if failure_msgs != '':
-                failure_msgs += ', \n'
-            failure_msgs += element
+    # Distinct messages other than 'ok', in the order they appear
+    failure_msgs = {}
 
-    return failure_msgs
+    for match in MESSAGE_RE.finditer(data):
+        element = match.group(1).translate(None, b"\\")
+        if element and element.lower() != b'ok':
+            failure_msgs.setdefault(element)
 
+    # Only the distinct messages are decoded
+    return ', \n'.join(element.decode() for element in failure_msgs)
 
-def extract_permissions(response):
-    if isinstance(response, list):
-        element = ''.join(response)
-    else:
-        element = response.content.decode()
 
-    if '<permissions>' not in element:
+def extract_permissions(response):
+    match = PERMISSIONS_RE.search(response_bytes(response))
+    if match is None:
         return 'No permissions'
 
-    element = element.split('<permissions>')[1:][0]
-    permissions = int(element.split('<')[0].replace("\\", ""))
-
-    return permissions
\ No newline at end of file
+    return int(match.group(1).translate(None, b"\\"))
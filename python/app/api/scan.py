@@ -3,376 +3,223 @@
 """
 import asyncio
 import datetime
-import json
 import logging
 import os
 import re
-import tempfile
 import threading
 import time
 import uuid
-from abc import ABC, abstractmethod
-from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
 
+import blake3
+from cachetools import TTLCache
 from flask import current_app, copy_current_request_context
 from flask_jwt_extended import jwt_required
 from flask_restful import Resource
+import orjson
 
 import helpers
+from app.scanners.filemanager import FileManagerDirectoryScanner
+from app.tasks import slow_scan_task
 from app.utils import files
 from config import Config
 
 logging.basicConfig(level=logging.INFO)
 
-# Global dictionary to keep track of scanning job statuses
-scans_states = {}
+# Scanning job statuses, bounded in number and forgotten after Config.SCAN_STATE_TTL seconds
+scans_states = TTLCache(maxsize=Config.SCAN_STATE_CAP, ttl=Config.SCAN_STATE_TTL)
+_states_lock = threading.RLock()
 
+# Celery state recorded for scans published to the broker and not yet picked up by a worker.
+# Celery reports PENDING both for those and for unknown scans, so it is stored before publishing.
+CELERY_QUEUED_STATE = 'QUEUED'
 
-class UserSpaceScanner(ABC):
+# Celery task states mapped to the statuses reported for scans run by the web workers
+CELERY_SCAN_STATUSES = {
+    CELERY_QUEUED_STATE: 'queued',
+    'STARTED': 'running',
+    'PROGRESS': 'running',
+    'RETRY': 'running',
+    'SUCCESS': 'completed',
+    'FAILURE': 'failed',
+    'REVOKED': 'failed',
+}
+
+# Recently parsed nextcloud directory scans, keyed by directory path and digest of the scan response
+_scandir_cache = TTLCache(maxsize=256, ttl=60)
+_scandir_cache_lock = threading.Lock()
+
+
+def _init_scan_worker():
     """
-    the API for scanning a user space for application-specific purposes.
-
-    From the perspective of this scanner, the user space is characterized by an identifier
-    and two locally mounted filesystem directories: the "user" directory where
-    the user has uploaded files, and the "system" directory where this scanner can
-    read and write files not visible to the end-user.  When a scan is initiated, an
-    implementation of this class is instantiated with these characteristics as properties,
-    and then its :py:meth:`fast_scan` and :py:meth:`slow_scan` functions are called in that
-    order.  Passed into these functions are the file-manager's metadata for the files (which
-    can include subdirectories) that should be scanned.  Note that the slow_scan is called
-    asynchronously (i.e. via the ``async`` keyword); however, :py:meth:`fast_scan` is
-    guaranteed to be called before :py:meth:`slow_scan` is queued for the same set of files.
-
-    The scanning functions are passed a dictionary of metadata that describe the files
-    that should be scanned.  The top-level properties capture information about the set of
-    files as a whole; the expected properties in this dictionary are as follows:
-
-    ``space_id``
-        str -- the identifier for the space
-    ``scan_time``
-        float -- the epoch time that the scan the produced this file listing was started.
-    ``scan_datetime``
-        str -- an ISO-formatted string form of the ``scan_time`` value (for display purposes)
-    ``fm_space_path``
-        str -- the file path of the user space from the file-manager perspective.  This is the
-        path that a user would see as the location within the file-manager (nextcloud)
-        application for the user's upload directory.
-    ``contents``
-        list -- an array of objects in which each object describes a file or subfolder within
-        the user space.  (See file metadata properties below.)
-    ``last_modified``
-        str -- a formatted string marking the last time any file was modified in this record space.
-    ``is_complete``
-        bool -- True, if the contents represents a complete listing of all files and folders
-        within the space.  If False, it is expected that the scannning functions will be called
-        additional times with different sets of contents until the entire contents have been
-        examined.
-
-    The metadata may include additional top-level properties.  For example, it may include
-    nextcloud properties describing the top level folder that is represents the user space.
-
-    Each object in the ``contents`` list is a dictionary that describes a file or folder.  The
-    following properties can be expected:
-
-    ``fileid``
-        str -- an identifier assigned by nextcloud for the file being described.
-    ``path``
-        str -- the path to the file or folder being described.  [This path will be the full
-        path to the file and will start with the value of ``fm_space_path`` (defined above).]
-    ``resource_type``
-        str -- the type of this resource.  Allowed values are: "file", "collection"
-    ``last_modified``
-        str -- the formatted date-time marking the time the file was last modified
-    ``size``
-        int -- the size of the file in bytes
-    ``scan_errors``
-        list[str] -- a list of messages describing errors that occurred while scanning this file.
-
-    Additional properties may be included.  For example, the file metadata may include nextcloud
-    file properties for the file.
-
-    The scanning functions can update any of this metadata in their returned version which will be
-    made accessible to the client.
-
-    See also the :py:class:`UserSpaceScannerBase` which can serve as a partially-implemented
-    base class for a full implementation.
+    give each slow scan worker thread an event loop of its own, reused by every scan it runs.
     """
+    asyncio.set_event_loop(asyncio.new_event_loop())
 
-    @property
-    def space_id(self) -> str:
-        """
-        the identifier for the user space
-        """
-        raise NotImplementedError()
-
-    @property
-    def user_dir(self) -> str:
-        """
-        the directory where the end-user has uploaded data.
-        """
-        raise NotImplementedError()
 
-    @property
-    def system_dir(self) -> str:
-        """
-        the directory where this scanner can read and write files that are not visible
-        to the end-user.
-        """
-        raise NotImplementedError()
+# Slow scans started without a task broker, at most Config.SCAN_MAX_CONCURRENT at a time
+_scan_executor = ThreadPoolExecutor(max_workers=Config.SCAN_MAX_CONCURRENT,
+                                    thread_name_prefix='slow-scan',
+                                    initializer=_init_scan_worker)
 
-    @abstractmethod
-    def fast_scan(self, content_md: Mapping) -> Mapping:
-        """
-        synchronously examine a set of files specified by the given file metadata.
-
-        The implementation should assume that this scanning was initiated via a web request
-        that is waiting for this function to finish; thus, this function should return as
-        quickly as possible.  Typically, an implementation would use this function to
-        _initialize_ some information about the files and store that information under the
-        system area.
-
-        Typically, the files described in the input metadata will be the full set of files
-        found in the user area.  However, a controller implementation (i.e. the implementation
-        that calls this function) may choose to call this function for only a subset of the
-        files in the space.  (For example, if the space contains a very large number of files,
-        the controller may choose to split the full collection over a series of calls.)
-
-        :param dict content_md:  the file-manager metadata describing the files to be
-                                 examined.  See the
-                                 :py:class:`class documentation<UserSpaceScanner>`
-                                 for the schema of this metadata.
-        :return:  the file-manager metadata that was passed in, possibly updated.
-                  :rtype: dict
-        """
-        raise NotImplementedError()
+# Nextcloud listings of subfolders, fetched while the folders before them are being scanned
+_listing_executor = ThreadPoolExecutor(max_workers=Config.SCAN_LISTING_WORKERS, thread_name_prefix='scan-listing')
 
-    @abstractmethod
-    async def slow_scan(self, content_md: Mapping) -> Mapping:
-        """
-        asynchronously examine a set of files specified by the given file metadata.
-
-        For the set of files described in the input metadata, it is guaranteed that the
-        :py:meth:`fast_scan` method has been called and returned its result.  If the
-        :py:meth:`fast_scan` method updated the metadata, those updates should be
-        included in the input metadata to this function.
-
-        :param dict content_md:  the content metadata returned by the
-                                 :py:meth:`fast_scan` method that describes the
-                                 files that should be scanned.  See the
-                                 :py:class:`class documentation<UserSpaceScanner>`
-                                 for the schema of this metadata.
-        :return:  the file-manager metadata that was passed in, possibly updated.
-                  :rtype: dict
-        """
-        raise NotImplementedError()
+# Matches the API user segment of nextcloud resource paths.  Without API_USER it is None and
+# scans are refused, since an empty pattern would not split the paths.
+_API_USER_RE = re.compile(re.escape(Config.API_USER), re.IGNORECASE) if Config.API_USER else None
 
 
-class UserSpaceScannerBase(UserSpaceScanner, ABC):
+def get_state(scan_id):
     """
-    a partial implementation of the :py:meth:`UserSpaceScanner` that can be used as a
-    base class for full implementations.
+    return a copy of the recorded state of a scanning job, or None if it is unknown.
     """
+    with _states_lock:
+        state = scans_states.get(scan_id)
+        return dict(state) if state is not None else None
 
-    def __init__(self, space_id: str, user_dir: str, sys_dir: str):
-        """
-        initialize the scanner.
-
-        :param str  space_id:  the identifier for the user space that should be scanned
-        :param str user_dir:  the full path on a local filesystem to the directory where
-                               the end-user has uploaded files.
-        :param str  sys_dir:  the full path on a local filesystem to a directory where
-                               the scanner can read and write files that are not visible
-                               to the end user.
-        """
-        self._id = space_id
-        self._userdir = user_dir
-        self._sysdir = sys_dir
-
-    @property
-    def space_id(self):
-        return self._id
-
-    @property
-    def user_dir(self):
-        return self._userdir
 
-    @property
-    def system_dir(self):
-        return self._sysdir
+def set_state(scan_id, **fields):
+    """
+    record the given fields in the state of a scanning job.  The least recently used
+    jobs are forgotten once more than ``Config.SCAN_STATE_CAP`` jobs are tracked.
+    """
+    with _states_lock:
+        state = scans_states.get(scan_id, {})
+        state.update(fields)
+        # Reassigning the state restarts its time to live
+        scans_states[scan_id] = state
 
 
-class FileManagerDirectoryScanner(UserSpaceScannerBase):
+def get_task_status(scan_id):
     """
-    an implementation of the :py:meth:`UserSpaceScanner` leveraging :py:meth:`UserSpaceScannerBase`
-    for the file manager scanning operations.
+    return the status of a scan queued on the task broker, or None if the result backend does
+    not know it.  Without a result backend Celery cannot report task states.
     """
+    if not Config.CELERY_RESULT_BACKEND:
+        return None
+    return CELERY_SCAN_STATUSES.get(slow_scan_task.AsyncResult(scan_id).state)
 
-    def __init__(self, space_id: str, user_dir: str, sys_dir: str):
-        super().__init__(space_id, user_dir, sys_dir)
-
-    def fast_scan(self, content_md: Mapping) -> Mapping:
-        logging.info("Starting fast scan")
-        scan_id = content_md['scan_id']
-        fm_system_path = content_md['fm_system_path']
 
-        # Upload initial report
-        filename = f"report-{scan_id}.json"
-        file_content = json.dumps(content_md, indent=4)
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        try:
-            # Write content as bytes
-            temp_file.write(file_content.encode('utf-8'))
-            # Go back to the beginning of the file
-            temp_file.seek(0)
-            files.post_file(temp_file.name, str(fm_system_path), filename)
-
-        except KeyError as e:
-            logging.exception(f"Key error: {e}")
-            raise KeyError(f"Key not found: {e}")
-        except json.JSONDecodeError as e:
-            logging.exception(f"JSON encoding error: {e}")
-            raise ValueError("Invalid JSON format")
-        except Exception as e:
-            logging.exception("An unexpected error occurred")
-            raise RuntimeError("An unexpected error occurred: " + str(e))
+def delete_state(scan_id):
+    """
+    forget the state of a scanning job.
+    """
+    with _states_lock:
+        scans_states.pop(scan_id, None)
 
-        finally:
-            # Close and delete the file
-            temp_file.close()
-            os.unlink(temp_file.name)
 
-        logging.info("Fast scan completed successfully")
-        return content_md
+class ScanFiles(Resource):
+    """Resource to handle file scanning operations."""
 
-    async def slow_scan(self, content_md: Mapping) -> Mapping:
+    @staticmethod
+    def scan_nextcloud_directory(fm_file_path):
         """
-        Perform a custom scan by calculating file checksums if the file has been modified after
-        the last checksum date (or there has never been a checksum calculated).
-        This method is asynchronous and scans each file of the contents.
+        Runs the nextcloud scan of a directory and parses its listing.  The scan always runs, so
+        that files written to the disk without nextcloud knowing are picked up, but parsed
+        listings are cached briefly so that back-to-back scans returning the same listing reuse them.
 
         Args:
-            content_md (Mapping): Metadata describing the files to be scanned.
+            fm_file_path (str): File manager file path relative to the root directory.
 
         Returns:
-            Mapping:  The updated metadata with checksums added or updated for each file.
+            list: Parsed nextcloud metadata of each resource in the directory.
         """
-        logging.info("Starting slow scan")
-        try:
-            current_time = datetime.datetime.now()
-            scan_id = content_md['scan_id']
-            fm_system_path = content_md['fm_system_path']
-
-            last_scan = self.find_most_recent_scan(scan_id)
-
-            for resource in content_md['contents']:
-                checksum = None
-                if resource['resource_type'] == 'file':
-                    last_modified = datetime.datetime.fromisoformat(resource['last_modified']).replace(tzinfo=None)
-                    file_id = resource['fileid']
-
-                    last_checksum_date = datetime.datetime.fromisoformat('1970-01-01T00:00:00').replace(
-                        tzinfo=None).isoformat()
-                    if last_scan is not None:
-                        last_scan_content_md = next(
-                            (content_md for content_md in last_scan['contents'] if content_md['fileid'] == file_id),
-                            None)
-                        if last_scan_content_md is not None and 'last_checksum_date' in last_scan_content_md:
-                            last_checksum_date = datetime.datetime.fromisoformat(
-                                last_scan_content_md['last_checksum_date']).replace(tzinfo=None)
-                            if last_modified < last_checksum_date:
-                                checksum = last_scan_content_md['checksum']
-                                last_checksum_date = last_checksum_date.isoformat()
-
-                    if checksum is None:
-                        file_path = resource['path']
-                        checksum = helpers.calculate_checksum(file_path)
-                        last_checksum_date = current_time.isoformat()
-
-                    # Update resource
-                    resource['checksum'] = checksum
-                    resource['last_checksum_date'] = last_checksum_date
-
-                    # Update the report.json file after each resource has been updated
-                    update_json_data = json.dumps(content_md, indent=4)
-                    filename = f"report-{scan_id}.json"
-                    filepath = os.path.join(fm_system_path, filename)
-                    disk_filepath = os.path.join(self.system_dir, filename)
-                    files.put_file(update_json_data, filepath, disk_filepath)
-
-            logging.info("Slow scan completed successfully")
-            return content_md
-
-        except Exception as e:
-            logging.exception(f"An unexpected error occurred during the slow scan: {e}")
-            raise
-
-    def find_most_recent_scan(self, scan_id):
-        most_recent_file = None
-        most_recent_time = 0
-
-        for filename in os.listdir(self.system_dir):
-            file_path = os.path.join(self.system_dir, filename)
-            if not os.path.isfile(file_path):
-                continue
-            modification_time = os.path.getmtime(file_path)
-            # Exclude current scan file from the search
-            if scan_id not in os.path.basename(filename):
-                if modification_time > most_recent_time:
-                    most_recent_file = file_path
-                    most_recent_time = modification_time
-
-        if most_recent_file is None:
-            return None
-
-        # Read the most recent JSON file and convert it to a Python dictionary
-        with open(most_recent_file, 'r') as file:
-            data = json.load(file)
-
-        return data
+        nextcloud_xml = files.put_scandir(fm_file_path)
+        hasher = blake3.blake3()
+        for fragment in [nextcloud_xml] if isinstance(nextcloud_xml, (str, bytes)) else nextcloud_xml:
+            hasher.update(fragment.encode() if isinstance(fragment, str) else fragment)
+
+        key = (fm_file_path, hasher.digest())
+        with _scandir_cache_lock:
+            nextcloud_md = _scandir_cache.get(key)
+        if nextcloud_md is None:
+            nextcloud_md = helpers.parse_nextcloud_scan_xml(fm_file_path, nextcloud_xml)
+            with _scandir_cache_lock:
+                _scandir_cache[key] = nextcloud_md
+        return nextcloud_md
+
+    @classmethod
+    def prefetch_nextcloud_directory(cls, fm_file_path):
+        """
+        Starts the nextcloud scan of a directory in the background.
 
+        Args:
+            fm_file_path (str): File manager file path relative to the root directory.
 
-class ScanFiles(Resource):
-    """Resource to handle file scanning operations."""
+        Returns:
+            Future: Resolves to the parsed nextcloud metadata of each resource in the directory.
+        """
+        return _listing_executor.submit(cls.scan_nextcloud_directory, fm_file_path)
 
-    def scan_directory_contents(self, fm_file_path, root_dir_from_disk):
+    def scan_directory_contents(self, fm_file_path, root_dir_from_disk, nextcloud_md=None):
         """
         Recursively scans directories and their contents.
 
         Args:
             fm_file_path (str): File manager file path relative to the root directory.
             root_dir_from_disk (str): Root directory path from disk.
+            nextcloud_md (list): Parsed nextcloud metadata of the directory, if already fetched.
 
-        Returns:
-            list: List of metadata dictionaries for all files and directories.
+        Yields:
+            dict: Metadata dictionary for each file and directory, folders preceding their contents.
         """
-        contents = []
-        nextcloud_xml = files.put_scandir(fm_file_path)
-        nextcloud_md = helpers.parse_nextcloud_scan_xml(fm_file_path, nextcloud_xml)
-
+        if _API_USER_RE is None:
+            raise RuntimeError("API_USER must be set to scan nextcloud resource paths")
+        if nextcloud_md is None:
+            nextcloud_md = self.scan_nextcloud_directory(fm_file_path)
+
+        # The subfolder listings are independent requests, so they are all started up front
+        # and each one is only waited for once the scan reaches that subfolder
+        subfolder_listings = {}
         for resource in nextcloud_md:
-            resource_path = re.split(Config.API_USER, resource['path'], flags=re.IGNORECASE)[-1].lstrip('/')
-            nextcloud_resource_info = files.get_file(resource_path)
-
-            resource_md = {
-                'fileid': resource['fileid'],
-                'path': os.path.join(root_dir_from_disk, resource_path),
-                'size': resource['size'],
-                'last_modified': helpers.find_last_modified(nextcloud_resource_info),
-                'resource_type': helpers.determine_resource_type(resource),
-                'scan_errors': []
-            }
+            if helpers.determine_resource_type(resource) == 'folder':
+                resource_path = _API_USER_RE.split(resource['path'])[-1].lstrip('/')
+                subfolder_listings[resource_path] = self.prefetch_nextcloud_directory(resource_path)
 
-            if resource_md['resource_type'] == 'folder':
-                if resource_md not in contents:
-                    contents += [resource_md]
-                subdirectory_path = resource_path
-                resource_md = self.scan_directory_contents(subdirectory_path, root_dir_from_disk)
-            else:
-                resource_md = [resource_md]
-
-            contents += resource_md
+        # Last modified dates from a single directory listing, keyed by resource path
+        listed_last_modified = None
 
-        return contents
+        try:
+            for resource in nextcloud_md:
+                resource_path = _API_USER_RE.split(resource['path'])[-1].lstrip('/')
+                # The scan response normally carries each resource's last modified date
+                last_modified_value = resource.get('getlastmodified')
+                if not last_modified_value:
+                    # The user space is shared with the local filesystem, which is cheaper to query
+                    local_path = helpers.get_correct_path(os.path.join(root_dir_from_disk, resource_path))
+                    if os.path.exists(local_path):
+                        last_modified_value = formatdate(os.path.getmtime(local_path), usegmt=True)
+                if not last_modified_value:
+                    if listed_last_modified is None:
+                        directory_md = helpers.parse_nextcloud_scan_xml(fm_file_path,
+                                                                        files.get_directory(fm_file_path))
+                        listed_last_modified = {md['path']: md.get('getlastmodified') for md in directory_md}
+                    last_modified_value = listed_last_modified.get(resource['path'])
+                if not last_modified_value:
+                    raise ValueError(f"Last modified date not found for resource {resource_path}")
+                last_modified = helpers.format_last_modified(last_modified_value)
+
+                resource_md = {
+                    'fileid': resource['fileid'],
+                    'path': os.path.join(root_dir_from_disk, resource_path),
+                    'size': resource['size'],
+                    'last_modified': last_modified,
+                    'resource_type': helpers.determine_resource_type(resource),
+                    'scan_errors': []
+                }
+
+                yield resource_md
+
+                # The scanned folder itself is excluded from its own listing, so folders are never repeated
+                if resource_md['resource_type'] == 'folder':
+                    yield from self.scan_directory_contents(resource_path, root_dir_from_disk,
+                                                            subfolder_listings[resource_path].result())
+        finally:
+            # Listings not yet started are not needed if the scan stopped early
+            for listing in subfolder_listings.values():
+                listing.cancel()
 
     @jwt_required()
     def post(self, record_name):
@@ -386,6 +233,10 @@ class ScanFiles(Resource):
         Returns:
             tuple: Success response with status code 200, or error response with status code 500.
         """
+        if _API_USER_RE is None:
+            logging.error("API_USER is not configured, record spaces cannot be scanned")
+            return {'error': 'Internal Server Error', 'message': 'API_USER must be set to scan record spaces'}, 500
+
         try:
             logging.info(f"Starting file scanning process for record: {record_name}")
 
@@ -411,8 +262,9 @@ class ScanFiles(Resource):
             current_datetime = datetime.datetime.fromtimestamp(current_epoch_time)
             display_time = current_datetime.isoformat()
 
-            # Scan the initial directory and get content metadata
-            contents = self.scan_directory_contents(fm_space_path, root_dir_from_disk)
+            # Scan the initial directory and get content metadata.  The report holds every resource,
+            # so the whole listing is kept in memory; the generator only avoids per-folder copies.
+            contents = list(self.scan_directory_contents(fm_space_path, root_dir_from_disk))
 
             content_md = {
                 'space_id': space_id,
@@ -433,15 +285,27 @@ class ScanFiles(Resource):
             # Run fast scanning and update metadata
             content_md = scanner.fast_scan(content_md)
 
-            # Run the slowScan asynchronously using a thread
-            @copy_current_request_context
-            def run_slow_scan():
-                with current_app.app_context():
-                    # Read files from disk for performance
-                    asyncio.run(scanner.slow_scan(content_md))
-
-            thread = threading.Thread(target=run_slow_scan)
-            thread.start()
+            if Config.CELERY_BROKER_URL:
+                # Queue the slowScan on the task broker so it survives web worker restarts.  It is
+                # recorded as queued first, since a worker may start it as soon as it is published.
+                if Config.CELERY_RESULT_BACKEND:
+                    slow_scan_task.backend.store_result(scan_id, None, CELERY_QUEUED_STATE)
+                slow_scan_task.apply_async(args=(space_id, user_dir, sys_dir, content_md), task_id=scan_id)
+            else:
+                # Run the slowScan asynchronously on the shared scan workers
+                @copy_current_request_context
+                def run_slow_scan():
+                    with current_app.app_context():
+                        set_state(scan_id, status='running')
+                        try:
+                            # Read files from disk for performance
+                            asyncio.get_event_loop().run_until_complete(scanner.slow_scan(content_md))
+                            set_state(scan_id, status='completed', end_time=time.time())
+                        except Exception as e:
+                            set_state(scan_id, status='failed', end_time=time.time(), message=str(e))
+
+                set_state(scan_id, status='queued', space_id=space_id, start_time=current_epoch_time)
+                _scan_executor.submit(run_slow_scan)
 
             success_response = {
                 'success': 'POST',
@@ -493,10 +357,17 @@ class ScanFiles(Resource):
                 if scan_id in file_md['path']:
                     file_path = helpers.get_correct_path(
                         os.path.join(full_sys_dir, re.split(r'/|\\', file_md['path'])[-1]))
-                    with open(file_path, 'r') as file:
-                        content = json.load(file)
+                    with open(file_path, 'rb') as file:
+                        content = orjson.loads(file.read())
                         logging.info(f"Scan {scan_id} found and returned successfully")
-                        return {'success': 'GET', 'message': content}, 200
+                        success_response = {'success': 'GET', 'message': content}
+                        # Scans started by this worker or tracked by the Celery result backend also report
+                        # their progress
+                        state = get_state(scan_id)
+                        status = state['status'] if state is not None else get_task_status(scan_id)
+                        if status is not None:
+                            success_response['status'] = status
+                        return success_response, 200
 
             if content is None:
                 logging.error(f"Scan {scan_id} not found")
@@ -530,6 +401,7 @@ class ScanFiles(Resource):
             # Delete file
             logging.info(f"Attempting to delete file: {file_path}")
             response = files.delete_file(file_path)
+            delete_state(scan_id)
 
             if len(response) > 0:
                 exception_message = helpers.extract_exception_message(response)
@@ -0,0 +1,3 @@
+"""
+Scanners examining the files of user record spaces
+"""
@@ -0,0 +1,180 @@
+"""
+Interfaces for scanning user record spaces
+"""
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+
+
+class UserSpaceScanner(ABC):
+    """
+    the API for scanning a user space for application-specific purposes.
+
+    From the perspective of this scanner, the user space is characterized by an identifier
+    and two locally mounted filesystem directories: the "user" directory where
+    the user has uploaded files, and the "system" directory where this scanner can
+    read and write files not visible to the end-user.  When a scan is initiated, an
+    implementation of this class is instantiated with these characteristics as properties,
+    and then its :py:meth:`fast_scan` and :py:meth:`slow_scan` functions are called in that
+    order.  Passed into these functions are the file-manager's metadata for the files (which
+    can include subdirectories) that should be scanned.  Note that the slow_scan is called
+    asynchronously (i.e. via the ``async`` keyword); however, :py:meth:`fast_scan` is
+    guaranteed to be called before :py:meth:`slow_scan` is queued for the same set of files.
+
+    The scanning functions are passed a dictionary of metadata that describe the files
+    that should be scanned.  The top-level properties capture information about the set of
+    files as a whole; the expected properties in this dictionary are as follows:
+
+    ``space_id``
+        str -- the identifier for the space
+    ``scan_time``
+        float -- the epoch time that the scan the produced this file listing was started.
+    ``scan_datetime``
+        str -- an ISO-formatted string form of the ``scan_time`` value (for display purposes)
+    ``fm_space_path``
+        str -- the file path of the user space from the file-manager perspective.  This is the
+        path that a user would see as the location within the file-manager (nextcloud)
+        application for the user's upload directory.
+    ``contents``
+        list -- an array of objects in which each object describes a file or subfolder within
+        the user space.  (See file metadata properties below.)
+    ``last_modified``
+        str -- a formatted string marking the last time any file was modified in this record space.
+    ``is_complete``
+        bool -- True, if the contents represents a complete listing of all files and folders
+        within the space.  If False, it is expected that the scannning functions will be called
+        additional times with different sets of contents until the entire contents have been
+        examined.
+
+    The metadata may include additional top-level properties.  For example, it may include
+    nextcloud properties describing the top level folder that is represents the user space.
+
+    Each object in the ``contents`` list is a dictionary that describes a file or folder.  The
+    following properties can be expected:
+
+    ``fileid``
+        str -- an identifier assigned by nextcloud for the file being described.
+    ``path``
+        str -- the path to the file or folder being described.  [This path will be the full
+        path to the file and will start with the value of ``fm_space_path`` (defined above).]
+    ``resource_type``
+        str -- the type of this resource.  Allowed values are: "file", "collection"
+    ``last_modified``
+        str -- the formatted date-time marking the time the file was last modified
+    ``size``
+        int -- the size of the file in bytes
+    ``scan_errors``
+        list[str] -- a list of messages describing errors that occurred while scanning this file.
+
+    Additional properties may be included.  For example, the file metadata may include nextcloud
+    file properties for the file.
+
+    The scanning functions can update any of this metadata in their returned version which will be
+    made accessible to the client.
+
+    See also the :py:class:`UserSpaceScannerBase` which can serve as a partially-implemented
+    base class for a full implementation.
+    """
+    __slots__ = ()
+
+    @property
+    def space_id(self) -> str:
+        """
+        the identifier for the user space
+        """
+        raise NotImplementedError()
+
+    @property
+    def user_dir(self) -> str:
+        """
+        the directory where the end-user has uploaded data.
+        """
+        raise NotImplementedError()
+
+    @property
+    def system_dir(self) -> str:
+        """
+        the directory where this scanner can read and write files that are not visible
+        to the end-user.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def fast_scan(self, content_md: Mapping) -> Mapping:
+        """
+        synchronously examine a set of files specified by the given file metadata.
+
+        The implementation should assume that this scanning was initiated via a web request
+        that is waiting for this function to finish; thus, this function should return as
+        quickly as possible.  Typically, an implementation would use this function to
+        _initialize_ some information about the files and store that information under the
+        system area.
+
+        Typically, the files described in the input metadata will be the full set of files
+        found in the user area.  However, a controller implementation (i.e. the implementation
+        that calls this function) may choose to call this function for only a subset of the
+        files in the space.  (For example, if the space contains a very large number of files,
+        the controller may choose to split the full collection over a series of calls.)
+
+        :param dict content_md:  the file-manager metadata describing the files to be
+                                 examined.  See the
+                                 :py:class:`class documentation<UserSpaceScanner>`
+                                 for the schema of this metadata.
+        :return:  the file-manager metadata that was passed in, possibly updated.
+                  :rtype: dict
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def slow_scan(self, content_md: Mapping) -> Mapping:
+        """
+        asynchronously examine a set of files specified by the given file metadata.
+
+        For the set of files described in the input metadata, it is guaranteed that the
+        :py:meth:`fast_scan` method has been called and returned its result.  If the
+        :py:meth:`fast_scan` method updated the metadata, those updates should be
+        included in the input metadata to this function.
+
+        :param dict content_md:  the content metadata returned by the
+                                 :py:meth:`fast_scan` method that describes the
+                                 files that should be scanned.  See the
+                                 :py:class:`class documentation<UserSpaceScanner>`
+                                 for the schema of this metadata.
+        :return:  the file-manager metadata that was passed in, possibly updated.
+                  :rtype: dict
+        """
+        raise NotImplementedError()
+
+
+class UserSpaceScannerBase(UserSpaceScanner, ABC):
+    """
+    a partial implementation of the :py:meth:`UserSpaceScanner` that can be used as a
+    base class for full implementations.
+    """
+    __slots__ = ('_id', '_userdir', '_sysdir')
+
+    def __init__(self, space_id: str, user_dir: str, sys_dir: str):
+        """
+        initialize the scanner.
+
+        :param str  space_id:  the identifier for the user space that should be scanned
+        :param str user_dir:  the full path on a local filesystem to the directory where
+                               the end-user has uploaded files.
+        :param str  sys_dir:  the full path on a local filesystem to a directory where
+                               the scanner can read and write files that are not visible
+                               to the end user.
+        """
+        self._id = space_id
+        self._userdir = user_dir
+        self._sysdir = sys_dir
+
+    @property
+    def space_id(self):
+        return self._id
+
+    @property
+    def user_dir(self):
+        return self._userdir
+
+    @property
+    def system_dir(self):
+        return self._sysdir
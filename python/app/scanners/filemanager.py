@@ -0,0 +1,343 @@
+"""
+File manager scanner computing checksums of the files of a record space
+"""
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Mapping
+from contextlib import closing
+
+import ijson
+import orjson
+
+import helpers
+from app.scanners.base import UserSpaceScannerBase
+from app.utils import files
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+
+# Minimum number of seconds between progress uploads of a scan report
+REPORT_FLUSH_INTERVAL = 2
+
+# Checksum cache database, stored under the nextcloud root directory
+CHECKSUM_CACHE_FILENAME = '.scan_cache.db'
+# Seconds a scan waits for another scan to finish writing to the checksum cache
+CHECKSUM_CACHE_TIMEOUT = 30
+
+
+class FileManagerDirectoryScanner(UserSpaceScannerBase):
+    """
+    an implementation of the :py:meth:`UserSpaceScanner` leveraging :py:meth:`UserSpaceScannerBase`
+    for the file manager scanning operations.
+    """
+    __slots__ = ()
+
+    def __init__(self, space_id: str, user_dir: str, sys_dir: str):
+        super().__init__(space_id, user_dir, sys_dir)
+
+    def fast_scan(self, content_md: Mapping) -> Mapping:
+        logging.info("Starting fast scan")
+        scan_id = content_md['scan_id']
+        fm_system_path = content_md['fm_system_path']
+
+        # Upload initial report
+        filename = f"report-{scan_id}.json"
+        try:
+            # orjson serializes straight to bytes, which are uploaded from memory
+            file_content = orjson.dumps(content_md, option=orjson.OPT_INDENT_2)
+            files.post_file(file_content, str(fm_system_path), filename)
+
+        except KeyError as e:
+            logging.exception(f"Key error: {e}")
+            raise KeyError(f"Key not found: {e}")
+        except orjson.JSONEncodeError as e:
+            logging.exception(f"JSON encoding error: {e}")
+            raise ValueError("Invalid JSON format")
+        except Exception as e:
+            logging.exception("An unexpected error occurred")
+            raise RuntimeError("An unexpected error occurred: " + str(e))
+
+        logging.info("Fast scan completed successfully")
+        return content_md
+
+    async def slow_scan(self, content_md: Mapping) -> Mapping:
+        """
+        Perform a custom scan by calculating file checksums if the file has been modified after
+        the last checksum date (or there has never been a checksum calculated).
+        This method is asynchronous and scans each file of the contents.
+
+        Args:
+            content_md (Mapping): Metadata describing the files to be scanned.
+
+        Returns:
+            Mapping:  The updated metadata with checksums added or updated for each file.
+        """
+        logging.info("Starting slow scan")
+        try:
+            current_time = datetime.datetime.now()
+            current_epoch_time = current_time.timestamp()
+            algorithm = Config.CHECKSUM_ALGORITHM
+            scan_id = content_md['scan_id']
+
+            previous_fingerprint, previous_checksums = self.find_previous_scan(scan_id)
+
+            # Record the fingerprint of the contents so that the next scan can detect an unchanged space
+            fingerprint = self.contents_fingerprint(content_md)
+            content_md['last_scan_root_mtime'], content_md['last_scan_contents_count'] = fingerprint
+            unchanged = fingerprint == previous_fingerprint
+            if unchanged:
+                logging.info("Space unchanged since the previous scan, reusing its checksums")
+
+            # Files modified since their last checksum, to be hashed concurrently
+            pending = []
+
+            for resource in content_md['contents']:
+                if resource['resource_type'] == 'file':
+                    last_scan_content_md = previous_checksums.get(resource['fileid'])
+
+                    # Rehash files without a reusable checksum or modified since it was computed
+                    if last_scan_content_md is None or last_scan_content_md['checksum_algorithm'] != algorithm:
+                        pending.append(resource)
+                        continue
+                    if not unchanged:
+                        # Compare epoch times rather than timezone-stripped datetimes
+                        last_modified_time = datetime.datetime.fromisoformat(resource['last_modified']).timestamp()
+                        if last_modified_time >= last_scan_content_md['last_checksum_time']:
+                            pending.append(resource)
+                            continue
+
+                    # Update resource
+                    resource['checksum'] = last_scan_content_md['checksum']
+                    resource['checksum_algorithm'] = algorithm
+                    resource['last_checksum_date'] = last_scan_content_md['last_checksum_date']
+                    resource['last_checksum_time'] = last_scan_content_md['last_checksum_time']
+
+            if pending:
+                # The cache is shared with concurrent scans, so it is only locked briefly to write
+                # batches of new checksums, never while files are being hashed
+                with closing(self._open_checksum_cache()) as cache:
+                    uncached = []
+                    for resource in pending:
+                        # The local inode and nanosecond mtime catch changes nextcloud's dates to the second miss
+                        file_stat = self._stat_file(resource)
+                        if file_stat is None:
+                            # Files removed since the listing are reported rather than failing the scan
+                            resource['scan_errors'].append("File not found locally")
+                            continue
+                        row = cache.execute(
+                            "SELECT checksum FROM checksums WHERE fileid = ? AND size = ? AND mtime = ? "
+                            "AND ino = ? AND mtime_ns = ? AND algo = ?",
+                            (resource['fileid'], int(resource['size']), resource['last_modified'],
+                             file_stat.st_ino, file_stat.st_mtime_ns, algorithm)
+                        ).fetchone()
+                        if row is None:
+                            uncached.append((resource, file_stat))
+                            continue
+                        resource['checksum'] = row[0]
+                        resource['checksum_algorithm'] = algorithm
+                        resource['last_checksum_date'] = current_time.isoformat()
+                        resource['last_checksum_time'] = current_epoch_time
+
+                    # Read files in inode order, which approximates their order on disk, so that reads
+                    # are issued mostly sequentially
+                    uncached.sort(key=lambda item: item[1].st_ino)
+
+                    # hashlib and blake3 release the GIL while digesting, so threads overlap disk reads and hashing
+                    loop = asyncio.get_running_loop()
+                    with ThreadPoolExecutor(max_workers=Config.SCAN_MAX_WORKERS) as executor:
+                        async def checksum_resource(resource, file_stat):
+                            try:
+                                checksum = await loop.run_in_executor(
+                                    executor, helpers.calculate_checksum, resource['path'], algorithm)
+                            except OSError as e:
+                                # A file that cannot be read is reported on its own
+                                resource['scan_errors'].append(f"Checksum could not be calculated: {e}")
+                                checksum = None
+                            return resource, file_stat, checksum
+
+                        last_flush = time.monotonic()
+                        # Checksums not yet written to the cache
+                        new_rows = []
+                        # Record checksums as they complete so a large file does not hold back progress
+                        checksum_jobs = [checksum_resource(r, st) for r, st in uncached]
+                        for checksum_task in asyncio.as_completed(checksum_jobs):
+                            resource, file_stat, checksum = await checksum_task
+                            if checksum is not None:
+                                resource['checksum'] = checksum
+                                resource['checksum_algorithm'] = algorithm
+                                resource['last_checksum_date'] = current_time.isoformat()
+                                resource['last_checksum_time'] = current_epoch_time
+                                new_rows.append((resource['fileid'], int(resource['size']), resource['last_modified'],
+                                                 file_stat.st_ino, file_stat.st_mtime_ns, checksum, algorithm))
+
+                            # Publish progress periodically rather than after every file, keeping the
+                            # checksums computed so far if the scan is interrupted
+                            if time.monotonic() - last_flush >= REPORT_FLUSH_INTERVAL:
+                                self._write_checksums(cache, new_rows)
+                                new_rows.clear()
+                                self.update_report(content_md)
+                                last_flush = time.monotonic()
+
+                        self._write_checksums(cache, new_rows)
+
+            # Update the report.json file once all resources have been updated
+            self.update_report(content_md)
+
+            logging.info("Slow scan completed successfully")
+            return content_md
+
+        except Exception as e:
+            logging.exception(f"An unexpected error occurred during the slow scan: {e}")
+            raise
+
+    @staticmethod
+    def _stat_file(resource):
+        """
+        return the local filesystem status of a file resource, or None if it cannot be read.
+        """
+        try:
+            return os.stat(helpers.get_correct_path(resource['path']))
+        except OSError:
+            return None
+
+    @staticmethod
+    def _open_checksum_cache():
+        """
+        open the persistent cache of file checksums shared by all scans, keyed by the
+        nextcloud file id, size and last modified date of each file along with its local
+        inode and modification time in nanoseconds.  The connection is in autocommit mode;
+        writes are grouped in explicit transactions.
+        """
+        cache = sqlite3.connect(os.path.join(Config.NEXTCLOUD_ROOT_DIR_PATH, CHECKSUM_CACHE_FILENAME),
+                                timeout=CHECKSUM_CACHE_TIMEOUT, isolation_level=None)
+        try:
+            # Concurrent scans check and migrate the schema one at a time
+            cache.execute("BEGIN IMMEDIATE")
+            try:
+                columns = {row[1] for row in cache.execute("PRAGMA table_info(checksums)")}
+                if columns and 'mtime_ns' not in columns:
+                    # Caches written before the local file status was recorded are rebuilt
+                    cache.execute("DROP TABLE IF EXISTS checksums")
+                cache.execute("CREATE TABLE IF NOT EXISTS checksums "
+                              "(fileid TEXT PRIMARY KEY, size INT, mtime TEXT, ino INT, mtime_ns INT, "
+                              "checksum TEXT, algo TEXT)")
+                cache.execute("COMMIT")
+            except BaseException:
+                cache.execute("ROLLBACK")
+                raise
+        except BaseException:
+            cache.close()
+            raise
+        return cache
+
+    @staticmethod
+    def _write_checksums(cache, rows):
+        """
+        write a batch of computed checksums to the cache in a single short transaction.
+        """
+        if not rows:
+            return
+        cache.execute("BEGIN IMMEDIATE")
+        try:
+            cache.executemany(
+                "INSERT OR REPLACE INTO checksums (fileid, size, mtime, ino, mtime_ns, checksum, algo) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            cache.execute("COMMIT")
+        except BaseException:
+            cache.execute("ROLLBACK")
+            raise
+
+    def update_report(self, content_md: Mapping):
+        """
+        write the current state of the scan report to the system directory and the file manager.
+        """
+        scan_id = content_md['scan_id']
+        filename = f"report-{scan_id}.json"
+        update_json_data = orjson.dumps(content_md, option=orjson.OPT_INDENT_2)
+        filepath = os.path.join(content_md['fm_system_path'], filename)
+        disk_filepath = os.path.join(self.system_dir, filename)
+        files.put_file(update_json_data, filepath, disk_filepath)
+
+    @staticmethod
+    def contents_fingerprint(content_md: Mapping):
+        """
+        return a cheap fingerprint of the scanned contents: the latest modification date
+        of any resource and the number of resources.
+        """
+        contents = content_md['contents']
+        # nextcloud dates are all formatted in GMT, so they sort chronologically as strings
+        root_mtime = max((resource['last_modified'] for resource in contents), default=None)
+        return root_mtime, len(contents)
+
+    def find_previous_scan(self, scan_id):
+        """
+        load the contents fingerprint of the most recent previous scan report and index the
+        checksum metadata of its files by file id.  The report is streamed so that only the
+        checksum properties are kept in memory, and read once since the fingerprint is written
+        after the contents.
+        """
+        most_recent_file = self.find_most_recent_scan_file(scan_id)
+        if most_recent_file is None:
+            return None, {}
+
+        root_mtime = contents_count = None
+        previous_checksums = {}
+        with open(most_recent_file, 'rb') as file:
+            events = ijson.parse(file)
+            for prefix, event, value in events:
+                if prefix == 'last_scan_root_mtime':
+                    root_mtime = value
+                    continue
+                if prefix == 'last_scan_contents_count':
+                    contents_count = value
+                    continue
+                if prefix != 'contents.item' or event != 'start_map':
+                    continue
+
+                # Build each resource from the events up to the end of its object
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                for prefix, event, value in events:
+                    if prefix == 'contents.item' and event == 'end_map':
+                        break
+                    builder.event(event, value)
+                resource = builder.value
+
+                if 'checksum' in resource and 'last_checksum_date' in resource:
+                    last_checksum_time = resource.get('last_checksum_time')
+                    if last_checksum_time is None:
+                        # Reports predating the epoch field only carry the local ISO date
+                        last_checksum_time = datetime.datetime.fromisoformat(resource['last_checksum_date']).timestamp()
+                    # Checksums predating the algorithm field were computed with sha256
+                    previous_checksums[resource['fileid']] = {
+                        'checksum': resource['checksum'],
+                        'checksum_algorithm': resource.get('checksum_algorithm', 'sha256'),
+                        'last_checksum_date': resource['last_checksum_date'],
+                        'last_checksum_time': float(last_checksum_time),
+                    }
+
+        if root_mtime is None or contents_count is None:
+            return None, previous_checksums
+        return (root_mtime, contents_count), previous_checksums
+
+    def find_most_recent_scan_file(self, scan_id):
+        most_recent_file = None
+        most_recent_time = 0
+
+        # scandir entries carry the file type, avoiding an extra stat per report
+        with os.scandir(self.system_dir) as entries:
+            for entry in entries:
+                # Exclude current scan file from the search
+                if not entry.is_file() or scan_id in entry.name:
+                    continue
+                modification_time = entry.stat().st_mtime
+                if modification_time > most_recent_time:
+                    most_recent_file = entry.path
+                    most_recent_time = modification_time
+
+        return most_recent_file
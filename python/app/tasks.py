@@ -0,0 +1,42 @@
+"""
+Background tasks executed by celery workers
+"""
+import asyncio
+import logging
+
+from celery import Celery
+
+from app.scanners.filemanager import FileManagerDirectoryScanner
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+
+celery = Celery(__name__, broker=Config.CELERY_BROKER_URL, backend=Config.CELERY_RESULT_BACKEND)
+
+
+@celery.task(bind=True)
+def slow_scan_task(self, space_id, user_dir, sys_dir, content_md):
+    """
+    Run the slow scan of a record space outside of the web worker.
+
+    Args:
+        space_id (str): Identifier of the record space.
+        user_dir (str): Local path to the user directory of the space.
+        sys_dir (str): Local path to the system directory of the space.
+        content_md (dict): Content metadata returned by the fast scan.
+
+    Returns:
+        dict: The scan id and status of the completed scan.
+    """
+    # Imported here to avoid a circular import with the API modules
+    from app import create_app
+
+    scan_id = content_md['scan_id']
+    self.update_state(state='PROGRESS', meta={'scan_id': scan_id})
+
+    with create_app().app_context():
+        scanner = FileManagerDirectoryScanner(space_id, user_dir, sys_dir)
+        asyncio.run(scanner.slow_scan(content_md))
+
+    logging.info(f"Slow scan task completed for scan: {scan_id}")
+    return {'scan_id': scan_id, 'status': 'completed'}
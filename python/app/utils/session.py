@@ -0,0 +1,30 @@
+"""
+Shared HTTP session for the generic layer clients
+"""
+
+import base64
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config
+
+# Connections are kept alive and reused across requests to the generic layer.
+# Only idempotent methods are retried when the generic layer is temporarily unavailable.
+retry = Retry(total=3,
+              backoff_factor=0.2,
+              status_forcelist=(502, 503, 504),
+              allowed_methods=frozenset(['GET', 'PUT', 'DELETE']),
+              raise_on_status=False)
+adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=retry)
+
+session = requests.Session()
+session.verify = Config.PROD
+# The generic layer credentials never change, so the basic auth header is encoded once
+credentials = base64.b64encode(f"{Config.API_USER}:{Config.API_PWD}".encode()).decode()
+session.headers['Authorization'] = f"Basic {credentials}"
+# Every generic layer response is read as JSON
+session.headers['Accept'] = 'application/json'
+session.mount('http://', adapter)
+session.mount('https://', adapter)
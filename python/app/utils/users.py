@@ -2,10 +2,7 @@
 Connect with generic layer /users endpoints
 """
 
-import requests
-from flask import current_app
-from requests.auth import HTTPBasicAuth
-
+from app.utils.session import session
 from config import Config
 
 generic_api_endpoint = f"{Config.NEXTCLOUD_API_DEV_URL}/users"
@@ -17,24 +14,18 @@ def is_user(user):
 
 
 def get_users():
-    response = requests.get(f"{generic_api_endpoint}",
-                            auth=HTTPBasicAuth(current_app.config['API_USER'], current_app.config['API_PWD']),
-                            verify=Config.PROD)
+    response = session.get(f"{generic_api_endpoint}")
     return response.json()
 
 
 def post_user(user):
-    response = requests.post(f"{generic_api_endpoint}/{user}",
-                             auth=HTTPBasicAuth(current_app.config['API_USER'], current_app.config['API_PWD']),
-                             verify=Config.PROD)
+    response = session.post(f"{generic_api_endpoint}/{user}")
     # Response is not json serializable
     return response
 
 
 def get_user(user):
-    response = requests.get(f"{generic_api_endpoint}/{user}",
-                            auth=HTTPBasicAuth(current_app.config['API_USER'], current_app.config['API_PWD']),
-                            verify=Config.PROD)
+    response = session.get(f"{generic_api_endpoint}/{user}")
 
     if response.content.decode() == "user not found":
         return "User does not exist"
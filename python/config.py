@@ -12,4 +12,13 @@ class Config:
     API_USER = os.environ.get("API_USER")
     API_PWD = os.environ.get("API_PWD")
     PROD = False
+    DEBUG = os.environ.get("DEBUG", "false").lower() in ("1", "true", "yes")
     NEXTCLOUD_ROOT_DIR_PATH = os.environ.get("NEXTCLOUD_ROOT_DIR_PATH")
+    SCAN_MAX_WORKERS = int(os.environ.get("SCAN_MAX_WORKERS", min(32, (os.cpu_count() or 1) * 2)))
+    SCAN_LISTING_WORKERS = int(os.environ.get("SCAN_LISTING_WORKERS", 8))
+    SCAN_MAX_CONCURRENT = int(os.environ.get("SCAN_MAX_CONCURRENT", max(2, (os.cpu_count() or 1) // 2)))
+    CHECKSUM_ALGORITHM = os.environ.get("CHECKSUM_ALGORITHM", "blake3")
+    SCAN_STATE_CAP = int(os.environ.get("SCAN_STATE_CAP", 1024))
+    SCAN_STATE_TTL = int(os.environ.get("SCAN_STATE_TTL", 24 * 3600))
+    CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
+    CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND")
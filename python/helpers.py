@@ -1,122 +1,176 @@
 """
 helpers methods
 """
+import functools
 import hashlib
+import mmap
 import os
-import xml.etree.ElementTree as ET
+import re
 from email.utils import parsedate_to_datetime
+from pathlib import PurePosixPath
 
 from urllib.parse import unquote
 
+import blake3
+import xxhash
+from lxml import etree
+
+# Files at least this large are memory-mapped rather than read when computing a checksum
+CHECKSUM_MMAP_THRESHOLD = 1 << 20
+# Read size used when hashing smaller files
+CHECKSUM_CHUNK_SIZE = 1 << 20
+
+# Namespaces of WebDAV and sabre/dav (nextcloud's WebDAV server) responses
+XML_NAMESPACES = {'d': 'DAV:', 's': 'http://sabredav.org/ns'}
+
+# Qualified tags of the elements of a WebDAV multistatus response
+DAV_RESPONSE_TAG = '{DAV:}response'
+DAV_HREF_TAG = '{DAV:}href'
+DAV_PROP_PATH = '{DAV:}propstat/{DAV:}prop'
+
+# Text of the getlastmodified property of a WebDAV multistatus response, at its fixed location
+# and anywhere in the document for other layouts
+LAST_MODIFIED_XPATH = etree.XPath('d:response/d:propstat/d:prop/d:getlastmodified/text()',
+                                  namespaces=XML_NAMESPACES)
+ANY_LAST_MODIFIED_XPATH = etree.XPath('//d:getlastmodified/text()', namespaces=XML_NAMESPACES)
+
+# Exception details of a WebDAV error response
+EXCEPTION_XPATH = etree.XPath('//s:exception', namespaces=XML_NAMESPACES)
+EXCEPTION_MESSAGE_XPATH = etree.XPath('//s:message', namespaces=XML_NAMESPACES)
+
+# Status code of an OCS response
+STATUS_CODE_XPATH = etree.XPath('//statuscode')
+
+# getlastmodified property of a WebDAV response using the usual "d" prefix for the DAV: namespace
+LAST_MODIFIED_RE = re.compile(r'<d:getlastmodified(?:\s[^>]*)?>([^<]+)</d:getlastmodified>')
+
+# Text of the message and permissions elements of a generic layer response
+MESSAGE_RE = re.compile(rb'<message>([^<]*)')
+PERMISSIONS_RE = re.compile(rb'<permissions>([^<]*)')
+
+# Local names of the namespaced WebDAV property tags seen so far
+LOCAL_TAG_NAMES = {}
+
+# Files at least this large have their checksums memoized by calculate_checksum
+CHECKSUM_MEMO_MIN_SIZE = 4096
+# Number of file checksums memoized by calculate_checksum
+CHECKSUM_MEMO_SIZE = 1024
+
+# Checksum algorithms whose hashers are fed the file contents by calculate_checksum
+STREAM_HASHERS = {
+    "sha256": hashlib.sha256,
+    "xxh3_64": xxhash.xxh3_64,
+}
+
+
+# Nextcloud permission bitmask (0-31) to permission level
+PERMISSIONS_STRINGS = (("No permissions (No access to the file or folder)",)
+                       + ("Read",) * 3
+                       + ("Write",) * 4
+                       + ("Delete",) * 8
+                       + ("Share",) * 14
+                       + ("All",) * 2)
+
+# Permission level to the Nextcloud permission bitmask granting it
+PERMISSIONS_NUMBERS = {
+    "No permissions (No access to the file or folder)": 0,
+    "Read": 3,
+    "Write": 7,
+    "Delete": 15,
+    "Share": 29,
+    "All": 31,
+}
+
 
 def get_permissions_string(permission_number):
-    if permission_number == 0:
-        return "No permissions (No access to the file or folder)"
-    elif 1 <= permission_number <= 3:
-        return "Read"
-    elif 4 <= permission_number <= 7:
-        return "Write"
-    elif 8 <= permission_number <= 15:
-        return "Delete"
-    elif 16 <= permission_number <= 29:
-        return "Share"
-    elif permission_number == 30 or permission_number == 31:
-        return "All"
-    else:
-        return "Invalid permissions"
+    if 0 <= permission_number < len(PERMISSIONS_STRINGS):
+        return PERMISSIONS_STRINGS[permission_number]
+    return "Invalid permissions"
 
 
 def get_permissions_number(permission_string):
-    if permission_string == "No permissions (No access to the file or folder)":
-        return 0
-    elif permission_string == "Read":
-        return 3
-    elif permission_string == "Write":
-        return 7
-    elif permission_string == "Delete":
-        return 15
-    elif permission_string == "Share":
-        return 29
-    elif permission_string == "All":
-        return 31
-    else:
-        return "Invalid permissions"
+    return PERMISSIONS_NUMBERS.get(permission_string, "Invalid permissions")
+
+
+def response_bytes(response):
+    """
+    Return the body of a generic layer response, given as a list of strings or a response object
+    """
+    if isinstance(response, list):
+        return ''.join(response).encode()
+    return response.content
 
 
 def extract_failure_msgs(response):
-    failure_msgs = ''
+    data = response_bytes(response)
 
-    if isinstance(response, list):
-        elements = ''.join(response).split('<message>')[1:]
-    else:
-        elements = response.content.decode().split('<message>')[1:]
+    # Responses usually only report successes, which counting finds without scanning each message
+    if data.count(b'<message>') == data.count(b'<message>ok<') + data.count(b'<message>OK<'):
+        return ''
 
-    for element in elements:
-        element = element.split('<')[0].replace("\\", "")
-        if element.lower() != 'ok' and element not in failure_msgs:
-            if failure_msgs != '':
-                failure_msgs += ', \n'
-            failure_msgs += element
+    # Distinct messages other than 'ok', in the order they appear
+    failure_msgs = {}
 
-    return failure_msgs
+    for match in MESSAGE_RE.finditer(data):
+        element = match.group(1).translate(None, b"\\")
+        if element and element.lower() != b'ok':
+            failure_msgs.setdefault(element)
 
+    # Only the distinct messages are decoded
+    return ', \n'.join(element.decode() for element in failure_msgs)
 
-def extract_permissions(response):
-    if isinstance(response, list):
-        element = ''.join(response)
-    else:
-        element = response.content.decode()
 
-    if '<permissions>' not in element:
+def extract_permissions(response):
+    match = PERMISSIONS_RE.search(response_bytes(response))
+    if match is None:
         return 'No permissions'
 
-    element = element.split('<permissions>')[1:][0]
-    permissions = int(element.split('<')[0].replace("\\", ""))
-
-    return permissions
+    return int(match.group(1).translate(None, b"\\"))
 
 
 def parse_nextcloud_scan_xml(user_dir, scan_result):
-    # namespaces
-    ns = {
-        'd': 'DAV:',
-        'oc': 'http://owncloud.org/ns',
-        'nc': 'http://nextcloud.org/ns'
-    }
+    # Feed the XML fragments as they are, so that each parsed response can be released right away
+    parser = etree.XMLPullParser(events=('end',), tag=DAV_RESPONSE_TAG)
+    files = []
 
-    # Convert the list to a single string
-    xml_string = ''.join(scan_result)
+    # Path components of the user dir, whose own entry is left out of the listing.  Only paths
+    # ending with its last component need to be split to be compared.
+    user_dir_path = PurePosixPath(user_dir)
+    user_dir_parts = user_dir_path.parts
+    user_dir_name = user_dir_path.name
 
-    root = ET.fromstring(xml_string)
-    files = []
+    for fragment in [scan_result] if isinstance(scan_result, (str, bytes)) else scan_result:
+        parser.feed(fragment)
 
-    for response in root.findall('d:response', ns):
-        file_info = {}
+        for _, response in parser.read_events():
+            file_info = {}
 
-        # Extract href which is the path of the file/directory
-        href = response.find('d:href', ns)
-        if href is not None:
-            file_info['path'] = href.text
+            # Extract href which is the path of the file/directory
+            href = response.find(DAV_HREF_TAG)
+            if href is not None:
+                file_info['path'] = href.text
 
-        # Extract properties
-        for propstat in response.findall('d:propstat', ns):
-            prop = propstat.find('d:prop', ns)
-            if prop is not None:
+            # Extract properties
+            for prop in response.iterfind(DAV_PROP_PATH):
                 for child in prop:
-                    # Remove namespace from tag for clean representation
-                    tag = child.tag.split('}')[-1]
+                    # Remove namespace from tag for clean representation, once per distinct tag
+                    tag = LOCAL_TAG_NAMES.get(child.tag)
+                    if tag is None:
+                        tag = LOCAL_TAG_NAMES[child.tag] = child.tag.rpartition('}')[2]
                     file_info[tag] = child.text
 
-        files.append(file_info)
+            path = file_info.get('path')
+            if path is None or not path.rstrip('/').endswith(user_dir_name) or \
+                    PurePosixPath(path).parts[-len(user_dir_parts):] != user_dir_parts:
+                files.append(file_info)
 
-    # remove the dict associated to the user dir
-    filtered_files = []
-    for file in files:
-        file_path = file['path']
-        if not file_path.endswith((user_dir, user_dir + '/')):
-            filtered_files.append(file)
+            # Drop the parsed response and the already processed siblings from the tree
+            response.clear()
+            while response.getprevious() is not None:
+                del response.getparent()[0]
 
-    return filtered_files
+    parser.close()
+    return files
 
 
 def determine_resource_type(resource: dict) -> str:
@@ -138,38 +192,52 @@ def find_last_modified(nextcloud_resource):
     """
     if isinstance(nextcloud_resource, list):
         # Response is from get_directory
-        xml_str = ''.join(nextcloud_resource)
+        fragments = nextcloud_resource
     elif isinstance(nextcloud_resource, dict) and 'metadata' in nextcloud_resource:
         # Response is from get_file
-        xml_str = nextcloud_resource['metadata']
+        fragments = [nextcloud_resource['metadata']]
     else:
         raise ValueError("Invalid nextcloud resource format")
 
-    # Parse the XML
-    root = ET.fromstring(xml_str)
+    # Only the first date is needed, which a regex finds in the fragments without building the whole tree
+    for fragment in fragments:
+        match = LAST_MODIFIED_RE.search(fragment.decode() if isinstance(fragment, bytes) else fragment)
+        if match is not None:
+            return format_last_modified(match.group(1))
 
-    # Find the getLastModified element
-    namespaces = {'d': 'DAV:'}
-    last_modified_element = root.find('.//d:getlastmodified', namespaces)
+    # Otherwise parse the XML fragments and find the getLastModified element, whatever its
+    # namespace prefix or however it is split across the fragments
+    root = etree.fromstringlist(fragments)
+    last_modified_values = LAST_MODIFIED_XPATH(root) or ANY_LAST_MODIFIED_XPATH(root)
 
-    if last_modified_element is None:
+    if not last_modified_values:
         raise ValueError("Last modified date not found in the nextcloud resource")
 
-    last_modified_value = last_modified_element.text
+    return format_last_modified(last_modified_values[0])
+
 
-    # Convert to ISO format
+@functools.lru_cache(maxsize=4096)
+def format_last_modified(last_modified_value):
+    """
+    Convert a WebDAV getlastmodified value (RFC 2822 date) to ISO format.  Files modified in
+    the same second share their date, so conversions are memoized.
+    """
     datetime_obj = parsedate_to_datetime(last_modified_value)
     iso_formatted_time = datetime_obj.isoformat()
 
     return iso_formatted_time
 
 
-def calculate_checksum(file_path: str, algorithm: str = "sha256") -> str:
+def calculate_checksum(file_path: str, algorithm: str = "blake3") -> str:
     """Calculate the checksum of a file.
 
+    Checksums of files of at least ``CHECKSUM_MEMO_MIN_SIZE`` bytes are memoized for as long as
+    the file keeps the same inode, modification time and size.
+
     Args:
         file_path (str): Path to the file.
-        algorithm (str): Algorithm to use for checksum. Currently only supports "sha256".
+        algorithm (str): Algorithm to use for checksum. Supports "blake3" (default), "sha256" and
+                         "xxh3_64" (a non-cryptographic hash, only suitable for change detection).
 
     Returns:
         str: The computed checksum.
@@ -177,20 +245,66 @@ def calculate_checksum(file_path: str, algorithm: str = "sha256") -> str:
     Raises:
         ValueError: If an unsupported algorithm is provided.
     """
-    correct_path = get_correct_path(file_path)
-    if algorithm == "sha256":
-        hasher = hashlib.sha256()
-    else:
+    if algorithm != "blake3" and algorithm not in STREAM_HASHERS:
         raise ValueError(f"Unsupported algorithm: {algorithm}")
 
-    with open(correct_path, 'rb') as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            hasher.update(chunk)
+    correct_path = get_correct_path(file_path)
+    file_stat = os.stat(correct_path)
+    if file_stat.st_size < CHECKSUM_MEMO_MIN_SIZE:
+        # Hashing a small file costs about as much as looking it up
+        return compute_checksum(correct_path, algorithm)
+    return memoized_checksum(correct_path, algorithm, file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+
+
+@functools.lru_cache(maxsize=CHECKSUM_MEMO_SIZE)
+def memoized_checksum(correct_path, algorithm, inode, mtime_ns, size):
+    """
+    Memoized :py:func:`compute_checksum`, keyed by the file status as well so that modified
+    files are hashed again
+    """
+    return compute_checksum(correct_path, algorithm)
+
+
+def compute_checksum(correct_path, algorithm):
+    """
+    Hash the contents of a file with a supported algorithm
+    """
+    if algorithm == "blake3":
+        # Memory-map the file and let blake3 hash its chunks across threads
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        hasher.update_mmap(correct_path)
+        return hasher.hexdigest()
+
+    # Unbuffered, so reads go straight into the digest buffers
+    with open(correct_path, 'rb', buffering=0) as file:
+        if hasattr(os, 'posix_fadvise'):
+            # The whole file is read once, front to back
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        if algorithm == "sha256" and hasattr(hashlib, 'file_digest'):
+            # Python 3.11+ digests the file in C with the GIL released
+            return hashlib.file_digest(file, algorithm).hexdigest()
+
+        hasher = STREAM_HASHERS[algorithm]()
+        if os.fstat(file.fileno()).st_size >= CHECKSUM_MMAP_THRESHOLD:
+            # Hash the mapped file in a single call without copying it into Python bytes
+            with mmap.mmap(file.fileno(), 0, prot=mmap.PROT_READ) as mapped_file:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    # Read ahead of the hasher and let hashed pages go, rather than loading the
+                    # whole file up front, which evicts and rereads files larger than memory
+                    mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+                hasher.update(mapped_file)
+        else:
+            for chunk in iter(lambda: file.read(CHECKSUM_CHUNK_SIZE), b""):
+                hasher.update(chunk)
 
     return hasher.hexdigest()
 
 
 def get_correct_path(path):
+    if '%' not in path:
+        # Nothing to decode, so either way the path is returned as is
+        return path
     decoded_path = unquote(path)
     if os.path.exists(decoded_path):
         return decoded_path
@@ -199,34 +313,27 @@ def get_correct_path(path):
 
 
 def extract_exception_message(xml_list):
-    # Combine the list of strings into a single XML string
-    xml_data = ''.join(xml_list)
-
-    # Parse the XML
-    root = ET.fromstring(xml_data)
+    # Parse the list of strings directly, without combining them first
+    root = etree.fromstringlist(xml_list)
 
     # Extract the exception message
-    namespace = {'d': 'DAV:', 's': 'http://sabredav.org/ns'}
-    exception = root.find('.//s:exception', namespace)
-    message = root.find('.//s:message', namespace)
+    exception = EXCEPTION_XPATH(root)
+    message = EXCEPTION_MESSAGE_XPATH(root)
 
-    if exception is not None and message is not None:
-        return {'error': exception.text, 'message': message.text}
+    if exception and message:
+        return {'error': exception[0].text, 'message': message[0].text}
 
     return None
 
 
 def extract_status_code(xml_list):
-    # Join the list into a single string
-    xml_data = ''.join(xml_list)
-
-    # Parse the XML data
-    root = ET.fromstring(xml_data)
+    # Parse the list of strings directly, without joining them first
+    root = etree.fromstringlist(xml_list)
 
     # Find the status code element and get its text
-    status_code_element = root.find('.//statuscode')
-    if status_code_element is not None:
-        status_code = int(status_code_element.text)
+    status_code_element = STATUS_CODE_XPATH(root)
+    if status_code_element:
+        status_code = int(status_code_element[0].text)
     else:
         status_code = None
 
@@ -234,8 +341,4 @@ def extract_status_code(xml_list):
 
 
 def calculate_size(contents):
-    total_size = 0
-    for item in contents:
-        if item['resource_type'] == 'file':
-            total_size += int(item['size'])
-    return str(total_size)
+    return str(sum(int(item['size']) for item in contents if item['resource_type'] == 'file'))
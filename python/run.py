@@ -1,6 +1,8 @@
 from app import create_app
+from config import Config
 
 app = create_app()
 
 if __name__ == "__main__":
-    app.run(port=9093, debug=True)
+    # The debugger and reloader slow down every request, so they are only enabled on demand
+    app.run(port=9093, debug=Config.DEBUG, threaded=True)
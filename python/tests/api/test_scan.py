@@ -0,0 +1,395 @@
+"""
+/scan endpoint unit tests
+"""
+
+import os
+import re
+import tempfile
+import unittest
+from http import HTTPStatus
+from unittest.mock import Mock, patch
+
+import orjson
+from cachetools import TTLCache
+
+from dotenv import load_dotenv
+from flask_testing import TestCase
+
+import helpers
+from app import create_app
+from app.api import scan
+from app.api.scan import ScanFiles
+from config import Config
+
+SCAN_XML = ['<?xml version="1.0"?>',
+            '<d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">'
+            '<d:response><d:href>/remote.php/dav/files/oar_api/mds2-1/mds2-1/</d:href>'
+            '<d:propstat><d:prop><oc:fileid>10</oc:fileid><oc:size>5</oc:size></d:prop></d:propstat></d:response>'
+            '<d:response><d:href>/remote.php/dav/files/oar_api/mds2-1/mds2-1/a.txt</d:href>'
+            '<d:propstat><d:prop><oc:fileid>11</oc:fileid><oc:size>5</oc:size>'
+            '<d:getlastmodified>Mon, 01 Jan 2024 00:00:00 GMT</d:getlastmodified></d:prop></d:propstat></d:response>'
+            '</d:multistatus>']
+
+SPACE_XML = ['<?xml version="1.0"?>',
+             '<d:multistatus xmlns:d="DAV:"><d:response>'
+             '<d:href>/remote.php/dav/files/oar_api/mds2-1/mds2-1/</d:href><d:propstat><d:prop>'
+             '<d:getlastmodified>Mon, 01 Jan 2024 00:00:00 GMT</d:getlastmodified>'
+             '</d:prop></d:propstat></d:response></d:multistatus>']
+
+
+def listing_xml(dir_path, names, last_modified='Mon, 01 Jan 2024 00:00:00 GMT'):
+    """
+    return a nextcloud scan of a directory of the space listing the given names, folders ending with a slash
+    """
+    last_modified_prop = f'<d:getlastmodified>{last_modified}</d:getlastmodified>' if last_modified else ''
+    responses = ''.join(
+        f'<d:response><d:href>/remote.php/dav/files/oar_api/{dir_path}/{name}</d:href><d:propstat><d:prop>'
+        f'<oc:fileid>{name}</oc:fileid><oc:size>1</oc:size>{last_modified_prop}</d:prop></d:propstat></d:response>'
+        for name in [''] + names)
+    return ['<?xml version="1.0"?>',
+            f'<d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">{responses}</d:multistatus>']
+
+
+def sys_dir_xml(scan_id):
+    return ['<?xml version="1.0"?>',
+            '<d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns"><d:response>'
+            f'<d:href>/remote.php/dav/files/oar_api/mds2-1/mds2-1-sys/report-{scan_id}.json</d:href>'
+            '<d:propstat><d:prop><oc:fileid>20</oc:fileid></d:prop></d:propstat></d:response></d:multistatus>']
+
+
+class TestScanFiles(TestCase):
+    def create_app(self):
+        load_dotenv(dotenv_path='../../../.env', override=True)
+        app = create_app()
+        app.config.from_object(Config)
+        return app
+
+    def get_test_jwt(self, user, pwd):
+        response = self.client.post(
+            '/api/auth',
+            json={'user': user, 'pwd': pwd}
+        )
+
+        if response.status_code != HTTPStatus.OK:
+            return None
+
+        return response.json['message']
+
+    def get_headers(self):
+        test_jwt = self.get_test_jwt(Config.API_USER, Config.API_PWD)
+
+        if test_jwt is None:
+            self.fail('Authentication failed during test setup')
+
+        return {
+            'Authorization': 'Bearer {}'.format(test_jwt)
+        }
+
+    @patch('app.api.scan.files.get_directory')
+    @patch('app.api.scan._API_USER_RE', None)
+    def test_post_without_api_user(self, mock_get_directory):
+        response = self.client.post('/api/record-space/mds2-1/scan', headers=self.get_headers())
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json, {'error': 'Internal Server Error',
+                                         'message': 'API_USER must be set to scan record spaces'})
+        mock_get_directory.assert_not_called()
+
+    @patch('app.api.scan.slow_scan_task')
+    @patch('app.api.scan.files.post_file')
+    @patch('app.api.scan.files.put_scandir')
+    @patch('app.api.scan.files.get_directory')
+    @patch('app.api.scan._API_USER_RE', re.compile('oar_api', re.IGNORECASE))
+    @patch.object(Config, 'CELERY_RESULT_BACKEND', 'redis://localhost/1')
+    @patch.object(Config, 'CELERY_BROKER_URL', 'redis://localhost/0')
+    def test_post_queues_slow_scan_on_broker(self, mock_get_directory, mock_put_scandir, mock_post_file,
+                                             mock_slow_scan_task):
+        mock_get_directory.return_value = SPACE_XML
+        mock_put_scandir.return_value = SCAN_XML
+        scan._scandir_cache.clear()
+
+        response = self.client.post('/api/record-space/mds2-1/scan', headers=self.get_headers())
+
+        self.assertEqual(response.status_code, 200)
+        scan_id = response.json['scan_id']
+
+        report, fm_system_path, filename = mock_post_file.call_args.args
+        self.assertEqual((fm_system_path, filename), ('mds2-1/mds2-1-sys', f'report-{scan_id}.json'))
+        content_md = orjson.loads(report)
+        self.assertEqual([resource['fileid'] for resource in content_md['contents']], ['11'])
+
+        # The scan is recorded as queued before it is published
+        mock_slow_scan_task.backend.store_result.assert_called_once_with(scan_id, None, scan.CELERY_QUEUED_STATE)
+        args, kwargs = mock_slow_scan_task.apply_async.call_args
+        self.assertEqual(kwargs['task_id'], scan_id)
+        self.assertEqual(kwargs['args'][0], 'mds2-1')
+        self.assertEqual(kwargs['args'][3]['scan_id'], scan_id)
+        self.assertIsNone(scan.get_state(scan_id))
+
+    @patch('app.api.scan.slow_scan_task')
+    @patch('app.api.scan.files.put_scandir')
+    @patch.object(Config, 'CELERY_RESULT_BACKEND', 'redis://localhost/1')
+    def test_get_maps_celery_states(self, mock_put_scandir, mock_slow_scan_task):
+        with tempfile.TemporaryDirectory() as root_dir, patch.object(Config, 'NEXTCLOUD_ROOT_DIR_PATH', root_dir):
+            os.makedirs(os.path.join(root_dir, 'mds2-1', 'mds2-1-sys'))
+            with open(os.path.join(root_dir, 'mds2-1', 'mds2-1-sys', 'report-scan1.json'), 'wb') as file:
+                file.write(orjson.dumps({'scan_id': 'scan1', 'contents': []}))
+            mock_put_scandir.return_value = sys_dir_xml('scan1')
+            headers = self.get_headers()
+
+            for state, status in (('QUEUED', 'queued'), ('PROGRESS', 'running'), ('SUCCESS', 'completed'),
+                                  ('FAILURE', 'failed')):
+                mock_slow_scan_task.AsyncResult.return_value.state = state
+                response = self.client.get('/api/record-space/mds2-1/scan/scan1', headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json['status'], status)
+                self.assertEqual(response.json['message'], {'scan_id': 'scan1', 'contents': []})
+
+            # Celery reports unknown tasks as pending, so no status is given for them
+            mock_slow_scan_task.AsyncResult.return_value.state = 'PENDING'
+            response = self.client.get('/api/record-space/mds2-1/scan/scan1', headers=headers)
+            self.assertNotIn('status', response.json)
+
+            # Without a result backend Celery cannot be asked
+            with patch.object(Config, 'CELERY_RESULT_BACKEND', None):
+                mock_slow_scan_task.AsyncResult.reset_mock()
+                response = self.client.get('/api/record-space/mds2-1/scan/scan1', headers=headers)
+                self.assertNotIn('status', response.json)
+                mock_slow_scan_task.AsyncResult.assert_not_called()
+
+
+class TestScanNextcloudDirectory(unittest.TestCase):
+    def setUp(self):
+        scan._scandir_cache.clear()
+
+    @patch('app.api.scan.helpers.parse_nextcloud_scan_xml', wraps=helpers.parse_nextcloud_scan_xml)
+    @patch('app.api.scan.files.put_scandir')
+    def test_listing_parse_is_cached(self, mock_put_scandir, mock_parse):
+        mock_put_scandir.return_value = SCAN_XML
+
+        listing = ScanFiles.scan_nextcloud_directory('mds2-1/mds2-1')
+        self.assertEqual([md['fileid'] for md in listing], ['11'])
+        self.assertIs(ScanFiles.scan_nextcloud_directory('mds2-1/mds2-1'), listing)
+
+        # The directory is rescanned every time, only the parse is reused
+        self.assertEqual(mock_put_scandir.call_count, 2)
+        self.assertEqual(mock_parse.call_count, 1)
+
+    @patch('app.api.scan.files.put_scandir')
+    def test_new_files_found_by_the_rescan_are_listed(self, mock_put_scandir):
+        mock_put_scandir.return_value = SCAN_XML
+        self.assertEqual(len(ScanFiles.scan_nextcloud_directory('mds2-1/mds2-1')), 1)
+
+        # A file written to the disk behind nextcloud's back shows up in the next rescan
+        mock_put_scandir.return_value = SCAN_XML[:-1] + [SCAN_XML[-1].replace(
+            '</d:multistatus>',
+            '<d:response><d:href>/remote.php/dav/files/oar_api/mds2-1/mds2-1/b.txt</d:href>'
+            '<d:propstat><d:prop><oc:fileid>12</oc:fileid><oc:size>3</oc:size></d:prop></d:propstat>'
+            '</d:response></d:multistatus>')]
+        listing = ScanFiles.scan_nextcloud_directory('mds2-1/mds2-1')
+        self.assertEqual([md['fileid'] for md in listing], ['11', '12'])
+
+    @patch('app.api.scan.files.put_scandir')
+    def test_listings_are_cached_per_directory(self, mock_put_scandir):
+        mock_put_scandir.return_value = SCAN_XML
+        listing = ScanFiles.scan_nextcloud_directory('mds2-1/mds2-1')
+        self.assertIsNot(ScanFiles.scan_nextcloud_directory('mds2-1/mds2-1/sub'), listing)
+
+
+@patch('app.api.scan._API_USER_RE', re.compile('oar_api', re.IGNORECASE))
+class TestScanDirectoryContents(unittest.TestCase):
+    LISTINGS = {
+        'mds2-1/mds2-1': ['a.txt', 'sub1/', 'sub2/'],
+        'mds2-1/mds2-1/sub1': ['b.txt', 'deep/'],
+        'mds2-1/mds2-1/sub1/deep': ['c.txt'],
+        'mds2-1/mds2-1/sub2': ['d.txt'],
+    }
+
+    def setUp(self):
+        scan._scandir_cache.clear()
+
+    def put_scandir(self, fm_file_path):
+        dir_path = fm_file_path.rstrip('/')
+        return listing_xml(dir_path, self.LISTINGS[dir_path])
+
+    @patch('app.api.scan.files.put_scandir')
+    def test_folders_precede_their_contents(self, mock_put_scandir):
+        mock_put_scandir.side_effect = self.put_scandir
+
+        contents = list(ScanFiles().scan_directory_contents('mds2-1/mds2-1', '/data'))
+
+        self.assertEqual([resource['path'] for resource in contents],
+                         ['/data/mds2-1/mds2-1/a.txt', '/data/mds2-1/mds2-1/sub1/',
+                          '/data/mds2-1/mds2-1/sub1/b.txt', '/data/mds2-1/mds2-1/sub1/deep/',
+                          '/data/mds2-1/mds2-1/sub1/deep/c.txt', '/data/mds2-1/mds2-1/sub2/',
+                          '/data/mds2-1/mds2-1/sub2/d.txt'])
+        self.assertEqual([resource['resource_type'] for resource in contents],
+                         ['file', 'folder', 'file', 'folder', 'file', 'folder', 'file'])
+        self.assertEqual(contents[0]['last_modified'], '2024-01-01T00:00:00+00:00')
+        self.assertEqual(mock_put_scandir.call_count, 4)
+
+    @patch.object(ScanFiles, 'prefetch_nextcloud_directory')
+    @patch('app.api.scan.files.put_scandir')
+    def test_subfolder_listings_start_up_front(self, mock_put_scandir, mock_prefetch):
+        mock_put_scandir.side_effect = self.put_scandir
+        listings = {}
+        mock_prefetch.side_effect = lambda fm_file_path: listings.setdefault(fm_file_path, Mock())
+
+        scanned = ScanFiles().scan_directory_contents('mds2-1/mds2-1', '/data')
+        self.assertEqual(next(scanned)['path'], '/data/mds2-1/mds2-1/a.txt')
+
+        # Both subfolders are being listed before the scan reaches them
+        self.assertEqual(sorted(listings), ['mds2-1/mds2-1/sub1/', 'mds2-1/mds2-1/sub2/'])
+        for listing in listings.values():
+            listing.result.assert_not_called()
+
+    @patch.object(ScanFiles, 'prefetch_nextcloud_directory')
+    @patch('app.api.scan.files.put_scandir')
+    def test_pending_listings_cancelled_when_scan_stops(self, mock_put_scandir, mock_prefetch):
+        mock_put_scandir.side_effect = self.put_scandir
+        listings = {}
+        mock_prefetch.side_effect = lambda fm_file_path: listings.setdefault(fm_file_path, Mock())
+
+        scanned = ScanFiles().scan_directory_contents('mds2-1/mds2-1', '/data')
+        next(scanned)
+        scanned.close()
+
+        for listing in listings.values():
+            listing.cancel.assert_called_once_with()
+
+    @patch('app.api.scan.files.put_scandir')
+    def test_failed_subfolder_listing_fails_the_scan(self, mock_put_scandir):
+        def put_scandir(fm_file_path):
+            if fm_file_path.startswith('mds2-1/mds2-1/sub2'):
+                raise ConnectionError('generic layer unavailable')
+            return self.put_scandir(fm_file_path)
+
+        mock_put_scandir.side_effect = put_scandir
+
+        with self.assertRaises(ConnectionError):
+            list(ScanFiles().scan_directory_contents('mds2-1/mds2-1', '/data'))
+
+
+@patch('app.api.scan._API_USER_RE', re.compile('oar_api', re.IGNORECASE))
+@patch('app.api.scan.files.get_file')
+@patch('app.api.scan.files.get_directory')
+@patch('app.api.scan.files.put_scandir')
+class TestLastModified(unittest.TestCase):
+    def setUp(self):
+        scan._scandir_cache.clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def scan(self):
+        return list(ScanFiles().scan_directory_contents('mds2-1/mds2-1', self.root_dir))
+
+    def test_dates_from_scan_response(self, mock_put_scandir, mock_get_directory, mock_get_file):
+        mock_put_scandir.return_value = listing_xml('mds2-1/mds2-1', ['a.txt', 'b.txt'],
+                                                    last_modified='Tue, 18 Jul 2023 19:29:36 GMT')
+
+        contents = self.scan()
+
+        self.assertEqual([resource['last_modified'] for resource in contents],
+                         ['2023-07-18T19:29:36+00:00', '2023-07-18T19:29:36+00:00'])
+        mock_get_file.assert_not_called()
+        mock_get_directory.assert_not_called()
+
+    def test_missing_dates_from_local_files(self, mock_put_scandir, mock_get_directory, mock_get_file):
+        os.makedirs(os.path.join(self.root_dir, 'mds2-1', 'mds2-1', 'sub'))
+        with open(os.path.join(self.root_dir, 'mds2-1', 'mds2-1', 'a.txt'), 'w') as file:
+            file.write('a')
+        os.utime(os.path.join(self.root_dir, 'mds2-1', 'mds2-1', 'a.txt'), (1700000000, 1700000000))
+        os.utime(os.path.join(self.root_dir, 'mds2-1', 'mds2-1', 'sub'), (1600000000, 1600000000))
+        mock_put_scandir.side_effect = lambda fm_file_path: (
+            listing_xml('mds2-1/mds2-1', ['a.txt', 'sub/'], last_modified=None)
+            if fm_file_path == 'mds2-1/mds2-1' else listing_xml('mds2-1/mds2-1/sub', []))
+
+        contents = self.scan()
+
+        self.assertEqual([resource['last_modified'] for resource in contents],
+                         ['2023-11-14T22:13:20+00:00', '2020-09-13T12:26:40+00:00'])
+        mock_get_file.assert_not_called()
+        mock_get_directory.assert_not_called()
+
+    def test_remaining_dates_from_one_directory_listing(self, mock_put_scandir, mock_get_directory, mock_get_file):
+        # Neither the scan response nor the local filesystem has the dates
+        mock_put_scandir.return_value = listing_xml('mds2-1/mds2-1', ['a.txt', 'b.txt'], last_modified=None)
+        mock_get_directory.return_value = listing_xml('mds2-1/mds2-1', ['a.txt', 'b.txt'],
+                                                      last_modified='Wed, 25 Jan 2023 14:37:30 GMT')
+
+        contents = self.scan()
+
+        self.assertEqual([resource['last_modified'] for resource in contents],
+                         ['2023-01-25T14:37:30+00:00', '2023-01-25T14:37:30+00:00'])
+        mock_get_directory.assert_called_once_with('mds2-1/mds2-1')
+        mock_get_file.assert_not_called()
+
+    def test_date_not_found(self, mock_put_scandir, mock_get_directory, mock_get_file):
+        mock_put_scandir.return_value = listing_xml('mds2-1/mds2-1', ['a.txt'], last_modified=None)
+        mock_get_directory.return_value = listing_xml('mds2-1/mds2-1', ['a.txt'], last_modified=None)
+
+        with self.assertRaisesRegex(ValueError, 'Last modified date not found for resource mds2-1/mds2-1/a.txt'):
+            self.scan()
+
+
+class TestScanStates(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        states = TTLCache(maxsize=2, ttl=100, timer=lambda: self.now)
+        patcher = patch('app.api.scan.scans_states', states)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fields_are_merged(self):
+        self.assertIsNone(scan.get_state('scan1'))
+
+        scan.set_state('scan1', status='queued', space_id='mds2-1')
+        scan.set_state('scan1', status='running')
+
+        self.assertEqual(scan.get_state('scan1'), {'status': 'running', 'space_id': 'mds2-1'})
+
+    def test_copies_are_returned(self):
+        scan.set_state('scan1', status='queued')
+        scan.get_state('scan1')['status'] = 'failed'
+
+        self.assertEqual(scan.get_state('scan1'), {'status': 'queued'})
+
+    def test_delete_state(self):
+        scan.set_state('scan1', status='completed')
+        scan.delete_state('scan1')
+        scan.delete_state('unknown')
+
+        self.assertIsNone(scan.get_state('scan1'))
+
+    def test_number_of_states_is_bounded(self):
+        scan.set_state('scan1', status='completed')
+        scan.set_state('scan2', status='running')
+        scan.get_state('scan1')
+        scan.set_state('scan3', status='queued')
+
+        # The least recently used state is forgotten
+        self.assertIsNone(scan.get_state('scan2'))
+        self.assertEqual(scan.get_state('scan1'), {'status': 'completed'})
+        self.assertEqual(scan.get_state('scan3'), {'status': 'queued'})
+
+    def test_states_expire(self):
+        scan.set_state('scan1', status='running')
+        scan.set_state('scan2', status='running')
+
+        # Updating a state restarts its time to live
+        self.now = 60
+        scan.set_state('scan1', status='completed')
+        self.now = 120
+
+        self.assertEqual(scan.get_state('scan1'), {'status': 'completed'})
+        self.assertIsNone(scan.get_state('scan2'))
+
+        self.now = 200
+        self.assertIsNone(scan.get_state('scan1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
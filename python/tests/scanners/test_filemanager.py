@@ -0,0 +1,212 @@
+"""
+file manager scanner unit tests
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import orjson
+
+from app.scanners import filemanager
+from app.scanners.filemanager import FileManagerDirectoryScanner
+from config import Config
+from helpers import calculate_checksum
+
+
+def write_report(data, file_path, disk_file_path):
+    with open(disk_file_path, 'wb') as file:
+        file.write(data)
+
+
+class TestFastScan(unittest.TestCase):
+    @patch('app.scanners.filemanager.files.post_file')
+    def test_report_uploaded_from_memory(self, mock_post_file):
+        content_md = {'scan_id': 'scan1', 'fm_system_path': 'mds2-1/mds2-1-sys', 'contents': []}
+        scanner = FileManagerDirectoryScanner('mds2-1', '/data/mds2-1/mds2-1', '/data/mds2-1/mds2-1-sys')
+
+        self.assertIs(scanner.fast_scan(content_md), content_md)
+
+        report, fm_system_path, filename = mock_post_file.call_args.args
+        self.assertIsInstance(report, bytes)
+        self.assertEqual(orjson.loads(report), content_md)
+        self.assertEqual((fm_system_path, filename), ('mds2-1/mds2-1-sys', 'report-scan1.json'))
+
+
+class TestSlowScan(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root_dir = self.tmp_dir.name
+        self.sys_dir = os.path.join(self.root_dir, 'mds2-1', 'mds2-1-sys')
+        self.user_dir = os.path.join(self.root_dir, 'mds2-1', 'mds2-1')
+        os.makedirs(self.sys_dir)
+        os.makedirs(self.user_dir)
+        self.scanner = FileManagerDirectoryScanner('mds2-1', self.user_dir, self.sys_dir)
+
+        patch.object(Config, 'NEXTCLOUD_ROOT_DIR_PATH', self.root_dir).start()
+        patch.object(Config, 'CHECKSUM_ALGORITHM', 'sha256').start()
+        patch.object(filemanager.files, 'put_file', side_effect=write_report).start()
+        self.checksum_mock = patch.object(filemanager.helpers, 'calculate_checksum',
+                                          wraps=calculate_checksum).start()
+        self.addCleanup(patch.stopall)
+
+        self.write_file('a.txt', b'first')
+        self.write_file('b.txt', b'second')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, content):
+        with open(os.path.join(self.user_dir, name), 'wb') as file:
+            file.write(content)
+
+    def content_md(self, scan_id, last_modified='2024-01-01T00:00:00+00:00'):
+        contents = [{'fileid': fileid, 'path': os.path.join(self.user_dir, name),
+                     'size': os.path.getsize(os.path.join(self.user_dir, name)),
+                     'last_modified': last_modified, 'resource_type': 'file', 'scan_errors': []}
+                    for fileid, name in (('1', 'a.txt'), ('2', 'b.txt'))]
+        contents.append({'fileid': '3', 'path': self.user_dir + '/sub/', 'size': 0,
+                         'last_modified': last_modified, 'resource_type': 'folder', 'scan_errors': []})
+        return {'scan_id': scan_id, 'fm_system_path': 'mds2-1/mds2-1-sys', 'contents': contents}
+
+    def scan(self, content_md):
+        self.checksum_mock.reset_mock()
+        return asyncio.run(self.scanner.slow_scan(content_md))
+
+    def hashed_paths(self):
+        return sorted(os.path.basename(call.args[0]) for call in self.checksum_mock.call_args_list)
+
+    def clear_reports(self):
+        for name in os.listdir(self.sys_dir):
+            os.remove(os.path.join(self.sys_dir, name))
+
+    def clear_cache(self):
+        os.remove(os.path.join(self.root_dir, filemanager.CHECKSUM_CACHE_FILENAME))
+
+    def cached_fileids(self):
+        with sqlite3.connect(os.path.join(self.root_dir, filemanager.CHECKSUM_CACHE_FILENAME)) as cache:
+            return sorted(row[0] for row in cache.execute("SELECT fileid FROM checksums"))
+
+    def test_first_scan_hashes_and_caches_files(self):
+        content_md = self.scan(self.content_md('scan1'))
+
+        self.assertEqual(self.hashed_paths(), ['a.txt', 'b.txt'])
+        self.assertEqual(content_md['contents'][0]['checksum'], hashlib.sha256(b'first').hexdigest())
+        self.assertEqual(content_md['contents'][0]['checksum_algorithm'], 'sha256')
+        self.assertNotIn('checksum', content_md['contents'][2])
+        self.assertEqual((content_md['last_scan_root_mtime'], content_md['last_scan_contents_count']),
+                         ('2024-01-01T00:00:00+00:00', 3))
+        self.assertEqual(self.cached_fileids(), ['1', '2'])
+
+        with open(os.path.join(self.sys_dir, 'report-scan1.json'), 'rb') as file:
+            self.assertEqual(orjson.loads(file.read())['contents'], content_md['contents'])
+
+    def test_previous_report_checksums_are_reused(self):
+        first = self.scan(self.content_md('scan1'))
+        self.clear_cache()
+        content_md = self.scan(self.content_md('scan2'))
+
+        self.assertEqual(self.hashed_paths(), [])
+        self.assertEqual(content_md['contents'][1]['checksum'], first['contents'][1]['checksum'])
+        self.assertEqual(content_md['contents'][1]['last_checksum_date'], first['contents'][1]['last_checksum_date'])
+
+    def test_files_modified_since_the_previous_scan_are_rehashed(self):
+        self.scan(self.content_md('scan1'))
+        self.write_file('a.txt', b'changed')
+        content_md = self.content_md('scan2', last_modified='2999-01-01T00:00:00+00:00')
+        content_md['contents'][1]['last_modified'] = '2024-01-01T00:00:00+00:00'
+        content_md = self.scan(content_md)
+
+        self.assertEqual(self.hashed_paths(), ['a.txt'])
+        self.assertEqual(content_md['contents'][0]['checksum'], hashlib.sha256(b'changed').hexdigest())
+
+    def test_unchanged_space_reuses_checksums_despite_dates(self):
+        # A date at or after the last checksum would be rehashed if the fingerprint did not match
+        self.scan(self.content_md('scan1', last_modified='2999-01-01T00:00:00+00:00'))
+        self.clear_cache()
+        self.scan(self.content_md('scan2', last_modified='2999-01-01T00:00:00+00:00'))
+
+        self.assertEqual(self.hashed_paths(), [])
+
+    def test_previous_checksums_of_another_algorithm_are_not_reused(self):
+        self.scan(self.content_md('scan1'))
+        self.clear_cache()
+        with patch.object(Config, 'CHECKSUM_ALGORITHM', 'blake3'):
+            content_md = self.scan(self.content_md('scan2'))
+
+        self.assertEqual(self.hashed_paths(), ['a.txt', 'b.txt'])
+        self.assertEqual(content_md['contents'][0]['checksum_algorithm'], 'blake3')
+
+    def test_cache_reused_without_previous_report(self):
+        first = self.scan(self.content_md('scan1'))
+        self.clear_reports()
+        content_md = self.scan(self.content_md('scan2'))
+
+        self.assertEqual(self.hashed_paths(), [])
+        self.assertEqual(content_md['contents'][0]['checksum'], first['contents'][0]['checksum'])
+
+    def test_cache_misses_on_local_file_changes(self):
+        self.scan(self.content_md('scan1'))
+        self.clear_reports()
+
+        # Same nextcloud size and date, but the local modification time changed
+        a_path = os.path.join(self.user_dir, 'a.txt')
+        stat = os.stat(a_path)
+        os.utime(a_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.scan(self.content_md('scan2'))
+        self.assertEqual(self.hashed_paths(), ['a.txt'])
+
+        # The nextcloud date is part of the key as well
+        self.clear_reports()
+        content_md = self.content_md('scan3')
+        content_md['contents'][1]['last_modified'] = '2024-02-01T00:00:00+00:00'
+        self.scan(content_md)
+        self.assertEqual(self.hashed_paths(), ['b.txt'])
+
+    def test_files_removed_locally_are_reported(self):
+        content_md = self.content_md('scan1')
+        os.remove(os.path.join(self.user_dir, 'a.txt'))
+        content_md = self.scan(content_md)
+
+        self.assertEqual(self.hashed_paths(), ['b.txt'])
+        self.assertNotIn('checksum', content_md['contents'][0])
+        self.assertEqual(content_md['contents'][0]['scan_errors'], ["File not found locally"])
+        self.assertEqual(content_md['contents'][1]['checksum'], hashlib.sha256(b'second').hexdigest())
+        self.assertEqual(self.cached_fileids(), ['2'])
+
+    def test_unreadable_files_are_reported(self):
+        def unreadable_a(file_path, algorithm):
+            if file_path.endswith('a.txt'):
+                raise PermissionError(13, 'Permission denied', file_path)
+            return calculate_checksum(file_path, algorithm)
+
+        self.checksum_mock.side_effect = unreadable_a
+        content_md = self.scan(self.content_md('scan1'))
+
+        self.assertNotIn('checksum', content_md['contents'][0])
+        self.assertEqual(len(content_md['contents'][0]['scan_errors']), 1)
+        self.assertTrue(content_md['contents'][0]['scan_errors'][0].startswith(
+            "Checksum could not be calculated: [Errno 13] Permission denied"))
+        self.assertEqual(content_md['contents'][1]['checksum'], hashlib.sha256(b'second').hexdigest())
+        self.assertEqual(content_md['contents'][1]['scan_errors'], [])
+        self.assertEqual(self.cached_fileids(), ['2'])
+
+    def test_old_cache_schema_is_rebuilt(self):
+        with sqlite3.connect(os.path.join(self.root_dir, filemanager.CHECKSUM_CACHE_FILENAME)) as cache:
+            cache.execute("CREATE TABLE checksums (fileid TEXT PRIMARY KEY, size INT, mtime TEXT, checksum TEXT)")
+            cache.execute("INSERT INTO checksums VALUES ('1', 5, '2024-01-01T00:00:00+00:00', 'stale')")
+        cache.close()
+
+        content_md = self.scan(self.content_md('scan1'))
+
+        self.assertEqual(self.hashed_paths(), ['a.txt', 'b.txt'])
+        self.assertEqual(content_md['contents'][0]['checksum'], hashlib.sha256(b'first').hexdigest())
+        self.assertEqual(self.cached_fileids(), ['1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+helpers unit tests
+"""
+
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+import blake3
+import xxhash
+
+import helpers
+
+SCAN_XML = [
+    '<?xml version="1.0"?>\n',
+    '<d:multistatus xmlns:d="DAV:" xmlns:s="http://sabredav.org/ns" xmlns:oc="http://owncloud.org/ns">',
+    '<d:response><d:href>/remote.php/dav/files/oar_api/mds2-1/mds2-1/</d:href>'
+    '<d:propstat><d:prop><oc:fileid>10</oc:fileid><oc:size>12</oc:size></d:prop></d:propstat></d:response>',
+    '<d:response><d:href>/remote.php/dav/files/oar_api/mds2-1/mds2-1/data.csv</d:href>'
+    '<d:propstat><d:prop><oc:fileid>11</oc:fileid><oc:size>5</oc:size>'
+    '<d:getlastmodified>Mon, 01 Jan 2024 00:00:00 GMT</d:getlastmodified></d:prop></d:propstat></d:response>',
+    # Ends with the user dir name without being the user dir
+    '<d:response><d:href>/remote.php/dav/files/oar_api/mds2-1/mds2-1/old-mds2-1/</d:href>'
+    '<d:propstat><d:prop><oc:fileid>12</oc:fileid><oc:size>7</oc:size></d:prop></d:propstat></d:response>',
+    # Same name as the user dir, under another space
+    '<d:response><d:href>/remote.php/dav/files/oar_api/mds2-2/mds2-1/</d:href>'
+    '<d:propstat><d:prop><oc:fileid>13</oc:fileid><oc:size>0</oc:size></d:prop></d:propstat></d:response>',
+    '</d:multistatus>',
+]
+
+
+class TestPermissionsHelpers(unittest.TestCase):
+    def test_get_permissions_string(self):
+        self.assertEqual(helpers.get_permissions_string(0), "No permissions (No access to the file or folder)")
+        self.assertEqual(helpers.get_permissions_string(1), "Read")
+        self.assertEqual(helpers.get_permissions_string(7), "Write")
+        self.assertEqual(helpers.get_permissions_string(15), "Delete")
+        self.assertEqual(helpers.get_permissions_string(29), "Share")
+        self.assertEqual(helpers.get_permissions_string(31), "All")
+        self.assertEqual(helpers.get_permissions_string(32), "Invalid permissions")
+        self.assertEqual(helpers.get_permissions_string(-1), "Invalid permissions")
+
+    def test_get_permissions_number(self):
+        self.assertEqual(helpers.get_permissions_number("Write"), 7)
+        self.assertEqual(helpers.get_permissions_number("All"), 31)
+        self.assertEqual(helpers.get_permissions_number("Owner"), "Invalid permissions")
+
+        for permission_string in helpers.PERMISSIONS_NUMBERS:
+            permission_number = helpers.get_permissions_number(permission_string)
+            self.assertEqual(helpers.get_permissions_string(permission_number), permission_string)
+
+    def test_extract_permissions(self):
+        response = ['<ocs>', '<meta><message>OK</message></meta>', '<data><permissions>31</permissions></data>',
+                    '</ocs>']
+        self.assertEqual(helpers.extract_permissions(response), 31)
+
+        response = Mock(content=b'<ocs><data><permissions>1\\5</permissions></data></ocs>')
+        self.assertEqual(helpers.extract_permissions(response), 15)
+
+        self.assertEqual(helpers.extract_permissions(['<ocs><data/></ocs>']), 'No permissions')
+
+
+class TestExtractFailureMsgs(unittest.TestCase):
+    def test_all_ok(self):
+        response = ['<ocs>', '<message>OK</message>', '<message>ok</message>', '</ocs>']
+        self.assertEqual(helpers.extract_failure_msgs(response), '')
+        self.assertEqual(helpers.extract_failure_msgs(Mock(content=b'<ocs><meta/></ocs>')), '')
+
+    def test_distinct_messages(self):
+        response = ['<ocs>', '<message>Not found</message>', '<message>OK</message>',
+                    '<message>Not\\ found</message>', '<message>Wrong path</message>',
+                    '<message>Not found</message>', '<message></message>', '</ocs>']
+        self.assertEqual(helpers.extract_failure_msgs(response), 'Not found, \nWrong path')
+
+    def test_messages_only_differing_in_case_are_kept(self):
+        response = Mock(content=b'<ocs><message>Failed</message><message>failed</message></ocs>')
+        self.assertEqual(helpers.extract_failure_msgs(response), 'Failed, \nfailed')
+
+
+class TestParseNextcloudScanXml(unittest.TestCase):
+    def test_user_dir_entry_is_filtered(self):
+        files = helpers.parse_nextcloud_scan_xml('mds2-1/mds2-1', SCAN_XML)
+
+        self.assertEqual([file_info['fileid'] for file_info in files], ['11', '12', '13'])
+        self.assertEqual(files[0], {'path': '/remote.php/dav/files/oar_api/mds2-1/mds2-1/data.csv',
+                                    'fileid': '11', 'size': '5',
+                                    'getlastmodified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+
+    def test_whole_document(self):
+        self.assertEqual(helpers.parse_nextcloud_scan_xml('mds2-1/mds2-1', ''.join(SCAN_XML)),
+                         helpers.parse_nextcloud_scan_xml('mds2-1/mds2-1', SCAN_XML))
+        files = helpers.parse_nextcloud_scan_xml('mds2-1/mds2-1/', ''.join(SCAN_XML).encode())
+        self.assertEqual([file_info['fileid'] for file_info in files], ['11', '12', '13'])
+
+    def test_subfolder_listing(self):
+        files = helpers.parse_nextcloud_scan_xml('mds2-1/mds2-1/old-mds2-1', SCAN_XML)
+        self.assertEqual([file_info['fileid'] for file_info in files], ['10', '11', '13'])
+
+
+class TestCalculateChecksum(unittest.TestCase):
+    def setUp(self):
+        helpers.memoized_checksum.cache_clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp_dir.name, 'data.bin')
+        self.write(b'a' * helpers.CHECKSUM_MEMO_MIN_SIZE)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, content):
+        with open(self.file_path, 'wb') as file:
+            file.write(content)
+        self.content = content
+
+    def test_algorithms(self):
+        self.assertEqual(helpers.calculate_checksum(self.file_path),
+                         blake3.blake3(self.content).hexdigest())
+        self.assertEqual(helpers.calculate_checksum(self.file_path, 'sha256'),
+                         hashlib.sha256(self.content).hexdigest())
+        with self.assertRaises(ValueError):
+            helpers.calculate_checksum(self.file_path, 'md4')
+
+    def test_large_files(self):
+        # Large files are memory-mapped when the algorithm has no file digest of its own
+        self.write(os.urandom(helpers.CHECKSUM_MMAP_THRESHOLD + 12345))
+        self.assertEqual(helpers.calculate_checksum(self.file_path, 'xxh3_64'),
+                         xxhash.xxh3_64(self.content).hexdigest())
+        self.assertEqual(helpers.calculate_checksum(self.file_path, 'sha256'),
+                         hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(helpers.calculate_checksum(self.file_path),
+                         blake3.blake3(self.content).hexdigest())
+
+    def test_memoized_until_modified(self):
+        checksum = helpers.calculate_checksum(self.file_path, 'sha256')
+        self.assertEqual(helpers.calculate_checksum(self.file_path, 'sha256'), checksum)
+        self.assertEqual(helpers.memoized_checksum.cache_info().hits, 1)
+
+        self.write(b'b' * (helpers.CHECKSUM_MEMO_MIN_SIZE + 1))
+        self.assertEqual(helpers.calculate_checksum(self.file_path, 'sha256'),
+                         hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(helpers.memoized_checksum.cache_info().misses, 2)
+
+    def test_small_files_not_memoized(self):
+        self.write(b'small')
+        self.assertEqual(helpers.calculate_checksum(self.file_path, 'sha256'),
+                         hashlib.sha256(b'small').hexdigest())
+        self.assertEqual(helpers.memoized_checksum.cache_info().currsize, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+generic layer /files client unit tests
+"""
+
+import unittest
+from unittest.mock import patch
+
+from app.utils import files
+
+
+@patch('app.utils.files.session')
+class TestPostFile(unittest.TestCase):
+    def test_post_bytes(self, mock_session):
+        mock_session.post.return_value.headers = {'Content-Type': 'application/json'}
+        mock_session.post.return_value.json.return_value = {'status': 'ok'}
+
+        response = files.post_file(b'{"scan_id": "scan1"}', 'mds2-1/mds2-1-sys', 'report-scan1.json')
+
+        self.assertEqual(response, {'status': 'ok'})
+        mock_session.post.assert_called_once_with(
+            f"{files.generic_api_endpoint}/file/mds2-1/mds2-1-sys",
+            files={'file': ('report-scan1.json', b'{"scan_id": "scan1"}')})
+
+    def test_post_bytes_without_filename(self, mock_session):
+        with self.assertRaises(ValueError):
+            files.post_file(b'{}', 'mds2-1/mds2-1-sys')
+
+        mock_session.post.assert_not_called()
+
+    def test_non_json_response(self, mock_session):
+        mock_session.post.return_value.headers = {'Content-Type': 'text/html'}
+        mock_session.post.return_value.status_code = 502
+        mock_session.post.return_value.content = b'Bad Gateway'
+
+        response = files.post_file(b'{}', 'mds2-1/mds2-1-sys', 'report-scan1.json')
+
+        self.assertEqual(response, {'status': 502, 'content': b'Bad Gateway'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+shared generic layer session unit tests
+"""
+
+import base64
+import unittest
+from unittest.mock import patch
+
+from app.utils import files, session
+from config import Config
+
+
+class TestSession(unittest.TestCase):
+    def test_clients_share_the_session(self):
+        self.assertIs(files.session, session.session)
+
+    def test_connections_are_pooled(self):
+        for url in ('http://generic-layer/files', 'https://generic-layer/files'):
+            adapter = session.session.get_adapter(url)
+            self.assertIs(adapter, session.adapter)
+        self.assertEqual(session.adapter.poolmanager.connection_pool_kw['maxsize'], 64)
+        self.assertEqual(session.session.verify, Config.PROD)
+
+    def test_only_idempotent_requests_are_retried(self):
+        retry = session.adapter.max_retries
+
+        self.assertEqual(retry.total, 3)
+        self.assertEqual(set(retry.status_forcelist), {502, 503, 504})
+        self.assertEqual(retry.allowed_methods, {'GET', 'PUT', 'DELETE'})
+        self.assertTrue(retry.is_retry('PUT', 503))
+        self.assertFalse(retry.is_retry('POST', 503))
+        self.assertFalse(retry.is_retry('GET', 500))
+
+    def test_headers_set_once(self):
+        credentials = base64.b64encode(f"{Config.API_USER}:{Config.API_PWD}".encode()).decode()
+
+        self.assertEqual(session.session.headers['Authorization'], f"Basic {credentials}")
+        self.assertEqual(session.session.headers['Accept'], 'application/json')
+
+    @patch.object(session.session, 'get')
+    def test_requests_carry_no_per_call_auth(self, mock_get):
+        mock_get.return_value.json.return_value = ['<?xml version="1.0"?>']
+
+        files.get_directory('mds2-1/mds2-1')
+
+        mock_get.assert_called_once_with(f"{files.generic_api_endpoint}/directory/mds2-1/mds2-1")
+
+
+if __name__ == '__main__':
+    unittest.main()